@@ -1,18 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory, send_file, Response, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import os
 import io
+import csv
+import json
+import base64
+import bisect
+import tempfile
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+import openpyxl
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from datetime import date, datetime, timedelta
 import threading
 import time
 from werkzeug.utils import secure_filename
 from functools import wraps
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import click
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sanctamariacollege2023'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///school_management.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///school_management.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -60,6 +72,23 @@ class Attendance(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
     date = db.Column(db.Date, default=datetime.now().date())
     status = db.Column(db.String(20))  # Present, Half Day Present, Late Coming, Absent
+    
+    __table_args__ = (
+        db.Index('uq_attendance_student_date', 'student_id', 'date', unique=True),
+        db.Index('ix_attendance_date', 'date')
+    )
+
+class AttendanceArchive(db.Model):
+    """A closed term's attendance for one student, packed one nibble per day from start_date"""
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    term_name = db.Column(db.String(100))
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+    
+    __table_args__ = (db.Index('uq_attendance_archive_student_start', 'student_id', 'start_date', unique=True),)
 
 class Exam(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -77,6 +106,8 @@ class ExamResult(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
     grade = db.Column(db.String(5))
     percentage = db.Column(db.Float)
+    
+    __table_args__ = (db.Index('uq_exam_result_exam_student', 'exam_id', 'student_id', unique=True),)
 
 class FinalExam(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -116,6 +147,8 @@ class BOWCorporationResult(db.Model):
     grade = db.Column(db.String(5))
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    __table_args__ = (db.Index('ix_bow_result_exam_student', 'exam_id', 'student_id'),)
+    
     # Relationships
     student = db.relationship('Student', backref='bow_results')
     exam = db.relationship('FinalExam', backref='bow_results')
@@ -150,6 +183,57 @@ class CourseEnrollment(db.Model):
     # Relationships
     student = db.relationship('Student', backref='course_enrollments')
 
+class CourseAttendanceSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    period = db.Column(db.Integer, nullable=False, default=1)
+    taken_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (db.UniqueConstraint('course_id', 'date', 'period', name='uq_course_attendance_session'),)
+
+class CourseAttendance(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('course_attendance_session.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # Present, Half Day Present, Late Coming, Absent
+    
+    __table_args__ = (db.UniqueConstraint('session_id', 'student_id', name='uq_course_attendance_session_student'),)
+
+class CourseAttendanceSummary(db.Model):
+    """Per-course, per-student status counts kept in step with CourseAttendance writes"""
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    present = db.Column(db.Integer, default=0)
+    half_day = db.Column(db.Integer, default=0)
+    late = db.Column(db.Integer, default=0)
+    absent = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class StudentAttendanceRisk(db.Model):
+    """Rolling 7/30/90-day attendance counts per student, advanced incrementally by refresh_attendance_risk"""
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    records_7 = db.Column(db.Integer, default=0)
+    absent_7 = db.Column(db.Integer, default=0)
+    late_7 = db.Column(db.Integer, default=0)
+    records_30 = db.Column(db.Integer, default=0)
+    absent_30 = db.Column(db.Integer, default=0)
+    late_30 = db.Column(db.Integer, default=0)
+    records_90 = db.Column(db.Integer, default=0)
+    absent_90 = db.Column(db.Integer, default=0)
+    late_90 = db.Column(db.Integer, default=0)
+    risk_score = db.Column(db.Float, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class DataVersion(db.Model):
+    """Counter bumped whenever a dataset changes, used to key cached analytics"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
 class SystemConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     config_key = db.Column(db.String(100), unique=True, nullable=False)
@@ -185,8 +269,8 @@ class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
     invoice_number = db.Column(db.String(50), unique=True)
-    issue_date = db.Column(db.Date)
-    due_date = db.Column(db.Date)
+    issue_date = db.Column(db.Date, index=True)
+    due_date = db.Column(db.Date, index=True)
     total_amount = db.Column(db.Float)
     paid_amount = db.Column(db.Float, default=0)
     status = db.Column(db.String(20))  # Paid, Unpaid, Partially Paid
@@ -209,7 +293,7 @@ class InvoiceItem(db.Model):
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'))
-    payment_date = db.Column(db.Date)
+    payment_date = db.Column(db.Date, index=True)
     amount = db.Column(db.Float)
     payment_method = db.Column(db.String(50))  # Bank Transfer, Cash, etc.
     transaction_id = db.Column(db.String(100))
@@ -222,6 +306,103 @@ class Payment(db.Model):
     invoice = db.relationship('Invoice', backref='payments')
     recorder = db.relationship('User', backref='recorded_payments')
 
+# Listing dates for keyset pages: issue/payment dates are nullable, so rows without
+# one sort by the day they were created instead of falling out of the key range
+INVOICE_LIST_DATE = db.func.coalesce(Invoice.issue_date, db.func.date(Invoice.created_at))
+PAYMENT_LIST_DATE = db.func.coalesce(Payment.payment_date, db.func.date(Payment.created_at))
+db.Index('ix_invoice_list_date', INVOICE_LIST_DATE, Invoice.id)
+db.Index('ix_payment_list_date', PAYMENT_LIST_DATE, Payment.id)
+
+class FeeTemplate(db.Model):
+    # Standard fee lines billed each term; section and sponsorship_type of None apply to all
+    id = db.Column(db.Integer, primary_key=True)
+    class_name = db.Column(db.String(50), nullable=False)
+    section = db.Column(db.String(50))
+    sponsorship_type = db.Column(db.String(50))
+    description = db.Column(db.String(200), nullable=False)
+    item_type = db.Column(db.String(50))  # Tuition, Books, etc.
+    amount = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, default=1)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+class BillingRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    semester = db.Column(db.String(50), nullable=False)
+    academic_year = db.Column(db.String(20), nullable=False)
+    issue_date = db.Column(db.Date, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    accommodation_months = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='Pending')  # Pending, Running, Completed, Failed
+    total_students = db.Column(db.Integer, default=0)
+    processed_students = db.Column(db.Integer, default=0)
+    invoices_created = db.Column(db.Integer, default=0)
+    last_student_id = db.Column(db.Integer, default=0)  # Resume point, committed with each chunk
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    completed_at = db.Column(db.DateTime)
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # Key into IMPORT_HANDLERS
+    filename = db.Column(db.String(255), nullable=False)  # Name of the uploaded file
+    stored_file = db.Column(db.String(255), nullable=False)  # Copy kept in IMPORT_JOB_FOLDER until the job finishes
+    params = db.Column(db.Text)  # JSON options passed to the handler
+    status = db.Column(db.String(20), default='Pending')  # Pending, Running, Completed, Failed
+    total_rows = db.Column(db.Integer)  # None until the handler knows it
+    processed_rows = db.Column(db.Integer, default=0)
+    error_count = db.Column(db.Integer, default=0)
+    errors_file = db.Column(db.String(255))  # Row-level error CSV in the handler's errors folder
+    summary = db.Column(db.Text)  # JSON summary returned by the handler
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+
+class PaymentRollup(db.Model):
+    # Daily payment totals per method, maintained alongside Payment writes
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    payment_method = db.Column(db.String(50), nullable=False, default='')
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('day', 'payment_method', name='uq_payment_rollup_day_method'),)
+
+class InvoiceItemRollup(db.Model):
+    # Daily billed totals per item type, keyed on the invoice issue date
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    item_type = db.Column(db.String(50), nullable=False, default='')
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('day', 'item_type', name='uq_invoice_item_rollup_day_type'),)
+
+class DocumentSequence(db.Model):
+    # Per-year counters behind invoice and receipt numbers
+    id = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('prefix', 'year', name='uq_document_sequence_prefix_year'),)
+
+class StudentBalance(db.Model):
+    # Materialized per-student ledger totals, kept in step with Invoice and Payment writes
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    total_billed = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0, index=True)
+    unpaid_invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    # Relationships
+    student = db.relationship('Student', backref=db.backref('balance_summary', uselist=False))
+
 class Sponsorship(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
@@ -395,49 +576,1144 @@ def ict_required(f):
 def accounts_required(f):
     return role_required('admin', 'accounts')(f)
 
-# Account Department Routes
-@app.route('/accounts/dashboard')
-@login_required
-@accounts_required
-def accounts_dashboard():
-    invoice_count = Invoice.query.count()
-    total_billed = db.session.query(db.func.sum(Invoice.total_amount)).scalar() or 0
-    total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).scalar() or 0
-    total_outstanding = total_billed - total_paid
+# Keyset pagination helpers
+Page = namedtuple('Page', ['items', 'next_cursor', 'per_page'])
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page into an opaque cursor string"""
+    payload = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor from encode_cursor back into values typed like columns"""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        return None
+    values = []
+    for value, column in zip(payload, columns):
+        python_type = column.type.python_type
+        if value is not None and python_type in (date, datetime):
+            value = python_type.fromisoformat(value)
+        values.append(value)
+    return values
+
+def keyset_page(query, order_by, key, cursor=None, per_page=50):
+    """Fetch one page of query after cursor.
+
+    order_by is a list of (column, descending) pairs whose last column is unique,
+    and key(row) returns the values of those columns for a fetched row.
+    """
+    columns = [column for column, _ in order_by]
+    after = decode_cursor(cursor, columns)
+    if after is not None:
+        clauses = []
+        for i, (column, descending) in enumerate(order_by):
+            equal = [c == v for c, v in zip(columns[:i], after[:i])]
+            beyond = column < after[i] if descending else column > after[i]
+            clauses.append(db.and_(*equal, beyond))
+        query = query.filter(db.or_(*clauses))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in order_by])
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return Page(rows, next_cursor, per_page)
+
+def get_per_page(default=50, maximum=200):
+    """Read a bounded page size from the request query string"""
+    per_page = request.args.get('per_page', default, type=int) or default
+    return max(1, min(per_page, maximum))
+
+def get_date_arg(name):
+    """Read an optional YYYY-MM-DD date from the request query string"""
+    try:
+        return datetime.strptime(request.args.get(name, ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+# Student directory
+# Sort keys for the directory; Student.id is appended as the unique tie-breaker
+STUDENT_SORT_FIELDS = {
+    'name': ('first_name', 'last_name'),
+    'admission_number': ('admission_number',),
+    'class': ('class_name', 'section', 'first_name', 'last_name')
+}
+
+USER_SORT_FIELDS = ('first_name', 'last_name')
+
+def _student_sort_column(field):
+    model = User if field in USER_SORT_FIELDS else Student
+    return db.func.coalesce(getattr(model, field), '')
+
+def _student_sort_value(student, field):
+    return getattr(student.user if field in USER_SORT_FIELDS else student, field) or ''
+
+def get_student_filters():
+    """Read the student directory search, filter and sort options from the query string"""
+    sort = request.args.get('sort', 'name')
+    return {
+        'q': (request.args.get('q') or '').strip(),
+        'class_name': request.args.get('class_name') or None,
+        'section': request.args.get('section') or None,
+        'sort': sort if sort in STUDENT_SORT_FIELDS else 'name'
+    }
+
+def student_directory_page(filters, cursor=None, per_page=50):
+    """One keyset page of students with their User joined in, filtered and sorted server-side"""
+    query = Student.query.join(Student.user).options(db.contains_eager(Student.user))
+    if filters['q']:
+        pattern = f"%{filters['q']}%"
+        query = query.filter(db.or_(
+            User.first_name.ilike(pattern),
+            User.last_name.ilike(pattern),
+            (User.first_name + ' ' + User.last_name).ilike(pattern),
+            Student.admission_number.ilike(pattern)
+        ))
+    if filters['class_name']:
+        query = query.filter(Student.class_name == filters['class_name'])
+    if filters['section']:
+        query = query.filter(Student.section == filters['section'])
+    
+    fields = STUDENT_SORT_FIELDS[filters['sort']]
+    columns = [_student_sort_column(field) for field in fields] + [Student.id]
+    return keyset_page(
+        query,
+        [(column, False) for column in columns],
+        key=lambda student: [_student_sort_value(student, field) for field in fields] + [student.id],
+        cursor=cursor,
+        per_page=per_page
+    )
+
+def student_class_options():
+    """Distinct (class_name, section) pairs for directory and picker filters"""
+    return db.session.query(Student.class_name, Student.section).filter(
+        Student.class_name.isnot(None)
+    ).distinct().order_by(Student.class_name, Student.section).all()
+
+def student_picker_context(default_per_page=50):
+    """Template context for pages that pick students: one filtered page plus paging state"""
+    filters = get_student_filters()
+    page = student_directory_page(filters, request.args.get('cursor'), get_per_page(default_per_page))
+    return {
+        'students': page.items,
+        'next_cursor': page.next_cursor,
+        'student_filters': filters,
+        'class_options': student_class_options(),
+        'student_search_url': url_for('students', format='json')
+    }
+
+# In-process caches
+class TTLCache:
+    """A small thread-safe cache whose entries expire after ttl seconds"""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        value = compute()
+        with self._lock:
+            # Drop expired entries so keys that are never requested again don't pile up
+            for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            self._entries[key] = (now + self.ttl, value)
+        return value
+    
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
     
-    # Get upcoming invoices due in the next 30 days
+    def invalidate_if(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+# System configuration
+def get_config_value(key, default=None):
+    """Return the JSON-decoded SystemConfig value for key, or default if unset"""
+    config = SystemConfig.query.filter_by(config_key=key).first()
+    if config is None:
+        return default
+    return json.loads(config.config_value)
+
+def set_config_value(key, value, description=None, updated_by=None):
+    """Store value as JSON under key in SystemConfig; the caller commits"""
+    config = SystemConfig.query.filter_by(config_key=key).first()
+    if config is None:
+        config = SystemConfig(config_key=key)
+        db.session.add(config)
+    config.config_value = json.dumps(value)
+    if description:
+        config.description = description
+    config.updated_by = updated_by
+    config.updated_at = datetime.now()
+    return config
+
+def bump_data_version(name):
+    """Increment the named data version in the current transaction"""
+    stmt = sqlite_insert(DataVersion).values(name=name, version=1, updated_at=datetime.now())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DataVersion.name],
+        set_={'version': DataVersion.version + 1, 'updated_at': stmt.excluded.updated_at}
+    )
+    db.session.execute(stmt)
+
+def get_data_version(name):
+    return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
+
+# Spreadsheet upload helpers
+UPLOAD_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%d %b %Y')
+
+def normalize_header(value):
+    return str(value).strip().lower().replace(' ', '_') if value is not None else ''
+
+def iter_upload_values(stream, filename):
+    """Stream (row_number, values) pairs, header row included, from an uploaded CSV or XLSX file.
+
+    XLSX files are opened in openpyxl read-only mode and CSV files are read line by
+    line, so the whole sheet is never held in memory. Blank rows are skipped.
+    """
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for row_number, values in enumerate(workbook.active.iter_rows(values_only=True), start=1):
+                if values and any(value is not None and value != '' for value in values):
+                    yield row_number, values
+        finally:
+            workbook.close()
+    elif filename.lower().endswith('.csv'):
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        for row_number, values in enumerate(csv.reader(text), start=1):
+            if any(value.strip() for value in values):
+                yield row_number, values
+        text.detach()
+    else:
+        raise ValueError('Unsupported file type; upload a .csv or .xlsx file')
+
+def iter_upload_rows(stream, filename):
+    """Stream (row_number, row_dict) pairs from an uploaded CSV or XLSX file.
+
+    Headers are lower-cased with spaces replaced by underscores.
+    """
+    rows = iter_upload_values(stream, filename)
+    first = next(rows, None)
+    if first is None:
+        return
+    headers = [normalize_header(value) for value in first[1]]
+    for row_number, values in rows:
+        yield row_number, dict(zip(headers, values))
+
+def parse_upload_date(value):
+    """Parse a date cell from an uploaded sheet, returning None when it is not a date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or '').strip()
+    for date_format in UPLOAD_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_upload_amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value or '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+IMPORT_ERROR_FIELDS = ['row_number', 'column', 'value', 'reason']
+
+def write_import_errors(summary, folder, prefix, errors, fieldnames=IMPORT_ERROR_FIELDS, key='errors'):
+    """Write rejected rows to a timestamped CSV in folder and record its count and name in summary"""
+    os.makedirs(folder, exist_ok=True)
+    errors_file = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.csv"
+    with open(os.path.join(folder, errors_file), 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(errors)
+    summary[key] = len(errors)
+    summary[f'{key}_file'] = errors_file
+    return errors_file
+
+def admission_number_index():
+    """Map stripped, upper-cased admission numbers to student ids with one query"""
+    return {
+        admission_number.strip().upper(): student_id
+        for student_id, admission_number in db.session.query(Student.id, Student.admission_number)
+        if admission_number
+    }
+
+# Import jobs
+# Large uploads are saved to disk and processed by a worker thread; the job row
+# records progress and the outcome so the browser can poll instead of waiting.
+IMPORT_JOB_FOLDER = os.path.join(app.instance_path, 'import_jobs')
+IMPORT_JOB_WORKERS = 2
+ImportHandler = namedtuple('ImportHandler', ['run', 'roles', 'errors_folder'])
+IMPORT_HANDLERS = {}
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_JOB_WORKERS, thread_name_prefix='import-job')
+
+def import_handler(kind, roles, errors_folder):
+    """Register fn(stream, filename, params, progress) as the handler for an import kind.
+
+    The handler returns a summary dict and may include rows, errors and
+    errors_file keys; progress(processed, total=None) commits the job's
+    counters, so only call it when the session has no pending import writes.
+    """
+    def decorator(fn):
+        IMPORT_HANDLERS[kind] = ImportHandler(fn, tuple(roles), errors_folder)
+        return fn
+    return decorator
+
+def queue_import_job(kind, file, params=None, created_by=None):
+    """Save an uploaded file, record a Pending job for it and hand it to the worker pool"""
+    if kind not in IMPORT_HANDLERS:
+        raise ValueError(f'Unknown import type: {kind}')
+    os.makedirs(IMPORT_JOB_FOLDER, exist_ok=True)
+    stored_file = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{secure_filename(file.filename)}"
+    file.save(os.path.join(IMPORT_JOB_FOLDER, stored_file))
+    
+    job = ImportJob(
+        kind=kind,
+        filename=file.filename,
+        stored_file=stored_file,
+        params=json.dumps(params or {}),
+        status='Pending',
+        created_by=created_by
+    )
+    db.session.add(job)
+    db.session.commit()
+    import_executor.submit(run_import_job, job.id)
+    return job
+
+def run_import_job(job_id):
+    """Process one Pending import job in a worker thread, recording progress and the outcome"""
+    with app.app_context():
+        # Claim the job with a conditional update so it never runs twice
+        claimed = ImportJob.query.filter_by(id=job_id, status='Pending').update({
+            'status': 'Running',
+            'started_at': datetime.now()
+        })
+        db.session.commit()
+        if not claimed:
+            return
+        job = db.session.get(ImportJob, job_id)
+        
+        def progress(processed, total=None):
+            job.processed_rows = processed
+            if total is not None:
+                job.total_rows = total
+            db.session.commit()
+        
+        path = os.path.join(IMPORT_JOB_FOLDER, job.stored_file)
+        try:
+            with open(path, 'rb') as stream:
+                summary = IMPORT_HANDLERS[job.kind].run(stream, job.filename, json.loads(job.params or '{}'), progress)
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'Failed'
+            job.error = str(e)
+            job.completed_at = datetime.now()
+            db.session.commit()
+            return
+        finally:
+            # The upload is only needed while the handler reads it
+            if os.path.exists(path):
+                os.remove(path)
+        
+        job.status = 'Completed'
+        job.summary = json.dumps(summary, default=str)
+        job.processed_rows = summary.get('rows', job.processed_rows)
+        job.total_rows = summary.get('rows', job.total_rows)
+        job.error_count = summary.get('errors', 0)
+        job.errors_file = summary.get('errors_file')
+        job.completed_at = datetime.now()
+        db.session.commit()
+
+def resume_import_jobs():
+    """Fail jobs a previous process left Running and requeue the Pending ones; returns both counts.
+
+    Call this from exactly one process and only while no other process is running
+    imports: under the debug reloader that is the serving child, and under a WSGI
+    server it is the resume-import-jobs command, run before the server starts.
+    """
+    with app.app_context():
+        interrupted = ImportJob.query.filter_by(status='Running').all()
+        for job in interrupted:
+            job.status = 'Failed'
+            job.error = 'Interrupted by a server restart; upload the file again'
+            job.completed_at = datetime.now()
+        db.session.commit()
+        for job in interrupted:
+            path = os.path.join(IMPORT_JOB_FOLDER, job.stored_file)
+            if os.path.exists(path):
+                os.remove(path)
+        pending = db.session.query(ImportJob.id).filter_by(status='Pending').order_by(ImportJob.id).all()
+        for (job_id,) in pending:
+            import_executor.submit(run_import_job, job_id)
+    return len(interrupted), len(pending)
+
+@app.cli.command('resume-import-jobs')
+def resume_import_jobs_command():
+    """Fail interrupted import jobs and run the queued ones; use before starting a WSGI server"""
+    failed, queued = resume_import_jobs()
+    import_executor.shutdown(wait=True)
+    click.echo(f'Marked {failed} interrupted import jobs as failed and ran {queued} queued jobs')
+
+# Student ledger summary
+def update_student_balances(deltas):
+    """Add billed/paid/unpaid-count deltas to StudentBalance rows in the current transaction.
+
+    Each delta is a dict with student_id and any of total_billed, total_paid,
+    unpaid_invoice_count and last_payment_date.
+    """
+    rows = []
+    for delta in deltas:
+        billed = delta.get('total_billed', 0)
+        paid = delta.get('total_paid', 0)
+        rows.append({
+            'student_id': int(delta['student_id']),
+            'total_billed': billed,
+            'total_paid': paid,
+            'balance': billed - paid,
+            'unpaid_invoice_count': delta.get('unpaid_invoice_count', 0),
+            'last_payment_date': delta.get('last_payment_date'),
+            'updated_at': datetime.now()
+        })
+    if not rows:
+        return
+    
+    stmt = sqlite_insert(StudentBalance)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StudentBalance.student_id],
+        set_={
+            'total_billed': StudentBalance.total_billed + excluded.total_billed,
+            'total_paid': StudentBalance.total_paid + excluded.total_paid,
+            'balance': StudentBalance.balance + excluded.balance,
+            'unpaid_invoice_count': StudentBalance.unpaid_invoice_count + excluded.unpaid_invoice_count,
+            'last_payment_date': db.func.max(
+                db.func.coalesce(StudentBalance.last_payment_date, excluded.last_payment_date),
+                db.func.coalesce(excluded.last_payment_date, StudentBalance.last_payment_date)
+            ),
+            'updated_at': excluded.updated_at
+        }
+    )
+    db.session.execute(stmt, rows)
+
+def get_student_balance(student_id):
+    """Return the StudentBalance summary for a student, or an empty one if never billed"""
+    summary = db.session.get(StudentBalance, student_id)
+    if summary is None:
+        summary = StudentBalance(student_id=student_id, total_billed=0, total_paid=0,
+                                 balance=0, unpaid_invoice_count=0)
+    return summary
+
+def rebuild_student_balances():
+    """Regenerate the StudentBalance table from scratch and return the number of rows"""
+    billed = db.func.coalesce(db.func.sum(Invoice.total_amount), 0)
+    paid = db.func.coalesce(db.func.sum(Invoice.paid_amount), 0)
+    invoice_totals = db.select(
+        Invoice.student_id.label('student_id'),
+        billed.label('total_billed'),
+        paid.label('total_paid'),
+        db.func.sum(db.case((Invoice.status == 'Unpaid', 1), else_=0)).label('unpaid_invoice_count')
+    ).where(Invoice.student_id.isnot(None)).group_by(Invoice.student_id).subquery()
+    last_payments = db.select(
+        Invoice.student_id.label('student_id'),
+        db.func.max(Payment.payment_date).label('last_payment_date')
+    ).join(Invoice, Invoice.id == Payment.invoice_id).group_by(Invoice.student_id).subquery()
+    
+    now = datetime.now()
+    summary_rows = db.select(
+        invoice_totals.c.student_id,
+        invoice_totals.c.total_billed,
+        invoice_totals.c.total_paid,
+        invoice_totals.c.total_billed - invoice_totals.c.total_paid,
+        invoice_totals.c.unpaid_invoice_count,
+        last_payments.c.last_payment_date,
+        db.literal(now, db.DateTime)
+    ).outerjoin(last_payments, last_payments.c.student_id == invoice_totals.c.student_id)
+    
+    db.session.execute(db.delete(StudentBalance))
+    db.session.execute(db.insert(StudentBalance).from_select(
+        ['student_id', 'total_billed', 'total_paid', 'balance',
+         'unpaid_invoice_count', 'last_payment_date', 'updated_at'],
+        summary_rows
+    ))
+    db.session.commit()
+    return StudentBalance.query.count()
+
+@app.cli.command('rebuild-student-balances')
+def rebuild_student_balances_command():
+    """Regenerate the per-student ledger summary table"""
+    count = rebuild_student_balances()
+    click.echo(f'Rebuilt ledger summaries for {count} students')
+
+# Document number sequences
+DOCUMENT_NUMBER_COLUMNS = {
+    'INV': Invoice.invoice_number,
+    'RCPT': Payment.receipt_number
+}
+
+def format_document_number(prefix, year, value):
+    return f"{prefix}-{year}-{value:04d}"
+
+def _highest_document_number(conn, prefix, year):
+    """Find the highest number already issued for a prefix and year, used once to seed a sequence"""
+    column = DOCUMENT_NUMBER_COLUMNS[prefix]
+    pattern = f"{prefix}-{year}-"
+    suffix = db.func.substr(column, len(pattern) + 1)
+    return conn.execute(
+        db.select(db.func.max(db.cast(suffix, db.Integer))).where(column.like(pattern + '%'))
+    ).scalar() or 0
+
+def reserve_document_numbers(prefix, count=1, year=None):
+    """Atomically reserve count consecutive document numbers for a prefix and year.
+
+    The counter is bumped in its own short transaction, so concurrent callers never
+    receive the same number. Call this before writing anything in the session, and
+    note that numbers from a rolled-back request are skipped rather than reused.
+    """
+    year = year or datetime.now().year
+    sequences = DocumentSequence.__table__
+    bump = sequences.update().where(
+        sequences.c.prefix == prefix,
+        sequences.c.year == year
+    ).values(last_value=sequences.c.last_value + count).returning(sequences.c.last_value)
+    
+    with db.engine.begin() as conn:
+        last_value = conn.execute(bump).scalar()
+        if last_value is None:
+            # First number of the year: start after anything issued before the sequence existed
+            seed = _highest_document_number(conn, prefix, year)
+            conn.execute(sqlite_insert(sequences).values(
+                prefix=prefix, year=year, last_value=seed
+            ).on_conflict_do_nothing())
+            last_value = conn.execute(bump).scalar()
+    
+    first_value = last_value - count + 1
+    return [format_document_number(prefix, year, value) for value in range(first_value, last_value + 1)]
+
+def next_document_number(prefix):
+    return reserve_document_numbers(prefix)[0]
+
+# Term billing
+def _fee_lines_for_student(templates, section, sponsorship_type):
+    """Pick the most specific matching fee templates for each item type"""
+    best = {}
+    for template in templates:
+        if template.section not in (None, section):
+            continue
+        if template.sponsorship_type not in (None, sponsorship_type):
+            continue
+        specificity = (template.section is not None) + (template.sponsorship_type is not None)
+        current = best.get(template.item_type)
+        if current is None or specificity > current[0]:
+            best[template.item_type] = (specificity, [template])
+        elif specificity == current[0]:
+            current[1].append(template)
+    return [template for _, matched in best.values() for template in matched]
+
+def run_term_billing(run, chunk_size=500, progress=None):
+    """Create term invoices for every student from fee templates, resuming from run.last_student_id.
+
+    Each chunk of students is written with bulk inserts and committed together with
+    the run's resume point, so a crashed run can simply be started again.
+    """
+    templates_by_class = {}
+    for template in FeeTemplate.query.filter_by(is_active=True).order_by(FeeTemplate.id).all():
+        templates_by_class.setdefault(template.class_name, []).append(template)
+    
+    active_fees = db.session.query(
+        StudentAccommodation.student_id.label('student_id'),
+        db.func.max(Accommodation.monthly_fee).label('monthly_fee')
+    ).join(
+        Accommodation, Accommodation.id == StudentAccommodation.accommodation_id
+    ).filter(StudentAccommodation.status == 'Active').group_by(StudentAccommodation.student_id).subquery()
+    
+    if run.status == 'Pending':
+        run.total_students = Student.query.count()
+    run.status = 'Running'
+    run.error = None
+    db.session.commit()
+    
+    try:
+        while True:
+            students = db.session.query(
+                Student.id, Student.class_name, Student.section,
+                Student.sponsorship_type, active_fees.c.monthly_fee
+            ).outerjoin(
+                active_fees, active_fees.c.student_id == Student.id
+            ).filter(
+                Student.id > run.last_student_id
+            ).order_by(Student.id).limit(chunk_size).all()
+            if not students:
+                break
+            
+            billable = []
+            for student in students:
+                lines = [{
+                    'description': template.description,
+                    'amount': template.amount,
+                    'quantity': template.quantity or 1,
+                    'item_type': template.item_type
+                } for template in _fee_lines_for_student(
+                    templates_by_class.get(student.class_name, []), student.section, student.sponsorship_type
+                )]
+                if run.accommodation_months and student.monthly_fee:
+                    lines.append({
+                        'description': 'Accommodation fee',
+                        'amount': student.monthly_fee,
+                        'quantity': run.accommodation_months,
+                        'item_type': 'Accommodation'
+                    })
+                if lines:
+                    billable.append((student.id, lines))
+            
+            if billable:
+                invoice_numbers = reserve_document_numbers('INV', len(billable), year=run.issue_date.year)
+                invoice_rows = [{
+                    'student_id': student_id,
+                    'invoice_number': invoice_number,
+                    'issue_date': run.issue_date,
+                    'due_date': run.due_date,
+                    'total_amount': sum(line['amount'] * line['quantity'] for line in lines),
+                    'paid_amount': 0,
+                    'status': 'Unpaid',
+                    'semester': run.semester,
+                    'academic_year': run.academic_year
+                } for (student_id, lines), invoice_number in zip(billable, invoice_numbers)]
+                invoice_ids = db.session.execute(
+                    db.insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True),
+                    invoice_rows
+                ).scalars().all()
+                
+                item_rows = [
+                    dict(line, invoice_id=invoice_id)
+                    for invoice_id, (_, lines) in zip(invoice_ids, billable)
+                    for line in lines
+                ]
+                db.session.execute(db.insert(InvoiceItem), item_rows)
+                update_finance_rollups(items=[
+                    (run.issue_date, item['item_type'], item['amount'] * item['quantity']) for item in item_rows
+                ])
+                update_student_balances([{
+                    'student_id': row['student_id'],
+                    'total_billed': row['total_amount'],
+                    'unpaid_invoice_count': 1
+                } for row in invoice_rows])
+            
+            run.last_student_id = students[-1].id
+            run.processed_students += len(students)
+            run.invoices_created += len(billable)
+            db.session.commit()
+            invalidate_finance_cache()
+            if progress:
+                progress(run)
+        
+        run.status = 'Completed'
+        run.completed_at = datetime.now()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        run.status = 'Failed'
+        run.error = str(e)
+        db.session.commit()
+        raise
+    return run
+
+@app.cli.command('bill-term')
+@click.option('--semester', help='Semester to bill, e.g. "Semester 1"')
+@click.option('--academic-year', help='Academic year to bill, e.g. "2026/2027"')
+@click.option('--issue-date', help='Invoice issue date (YYYY-MM-DD)')
+@click.option('--due-date', help='Invoice due date (YYYY-MM-DD)')
+@click.option('--accommodation-months', default=0, help='Months of active accommodation fees to bill')
+@click.option('--chunk-size', default=500, help='Students written per transaction')
+@click.option('--resume', 'resume_id', type=int, help='Resume an interrupted billing run by id')
+def bill_term_command(semester, academic_year, issue_date, due_date, accommodation_months, chunk_size, resume_id):
+    """Bill every student for a term from the active fee templates"""
+    if resume_id:
+        run = db.session.get(BillingRun, resume_id)
+        if run is None:
+            raise click.ClickException(f'Billing run {resume_id} not found')
+        if run.status == 'Completed':
+            raise click.ClickException(f'Billing run {resume_id} has already completed')
+    else:
+        if not (semester and academic_year and issue_date and due_date):
+            raise click.UsageError('--semester, --academic-year, --issue-date and --due-date are required')
+        existing = BillingRun.query.filter_by(semester=semester, academic_year=academic_year).first()
+        if existing:
+            raise click.ClickException(
+                f'{semester} {academic_year} already has billing run {existing.id} ({existing.status}); '
+                f'use --resume {existing.id} to continue it'
+            )
+        run = BillingRun(
+            semester=semester,
+            academic_year=academic_year,
+            issue_date=datetime.strptime(issue_date, '%Y-%m-%d').date(),
+            due_date=datetime.strptime(due_date, '%Y-%m-%d').date(),
+            accommodation_months=accommodation_months,
+            status='Pending'
+        )
+        db.session.add(run)
+        db.session.commit()
+    
+    def report(run):
+        click.echo(f'Run {run.id}: {run.processed_students}/{run.total_students} students, '
+                   f'{run.invoices_created} invoices')
+    
+    run_term_billing(run, chunk_size=chunk_size, progress=report)
+    click.echo(f'Billing run {run.id} completed: {run.invoices_created} invoices created')
+
+# Bank statement import
+PAYMENT_IMPORT_FOLDER = os.path.join(app.instance_path, 'payment_imports')
+
+def _clean_cell(value):
+    return str(value).strip() if value is not None else ''
+
+def build_payment_match_index():
+    """Load the dicts used to match statement rows, with one query per index.
+
+    Returns invoices by invoice_number, open invoices by admission number (oldest
+    due first) and the set of transaction ids that have already been recorded.
+    Invoice entries are mutable dicts shared between the indexes so running
+    balances stay consistent while a statement is applied.
+    """
+    by_number = {}
+    open_by_admission = {}
+    rows = db.session.query(
+        Invoice.id, Invoice.invoice_number, Invoice.student_id, Invoice.total_amount,
+        Invoice.paid_amount, Invoice.status, Student.admission_number
+    ).join(Student, Student.id == Invoice.student_id).order_by(Invoice.due_date, Invoice.id)
+    for row in rows:
+        entry = {
+            'id': row.id,
+            'student_id': row.student_id,
+            'total': row.total_amount or 0,
+            'paid': row.paid_amount or 0,
+            'status': row.status
+        }
+        if row.invoice_number:
+            by_number[row.invoice_number.upper()] = entry
+        if row.status != 'Paid' and row.admission_number:
+            open_by_admission.setdefault(row.admission_number.upper(), []).append(entry)
+    
+    seen_transactions = {
+        transaction_id.strip().upper()
+        for (transaction_id,) in db.session.query(Payment.transaction_id).filter(
+            Payment.transaction_id.isnot(None), Payment.transaction_id != ''
+        )
+    }
+    return by_number, open_by_admission, seen_transactions
+
+def _write_payment_batch(batch, receipt_numbers):
+    """Insert a batch of matched payments and apply them to invoices and ledger summaries without committing"""
+    for payment, receipt_number in zip(batch, receipt_numbers):
+        payment['receipt_number'] = receipt_number
+    
+    invoice_totals = {}
+    student_deltas = {}
+    for payment in batch:
+        invoice_totals[payment['invoice_id']] = invoice_totals.get(payment['invoice_id'], 0) + payment['amount']
+        delta = student_deltas.setdefault(payment.pop('_student_id'), {'total_paid': 0, 'unpaid_invoice_count': 0})
+        delta['total_paid'] += payment['amount']
+        delta['unpaid_invoice_count'] -= payment.pop('_cleared_unpaid')
+        if delta.get('last_payment_date') is None or payment['payment_date'] > delta['last_payment_date']:
+            delta['last_payment_date'] = payment['payment_date']
+    
+    db.session.execute(db.insert(Payment), batch)
+    
+    invoices = Invoice.__table__
+    db.session.execute(
+        invoices.update().where(invoices.c.id == db.bindparam('invoice_pk')).values(
+            paid_amount=db.func.coalesce(invoices.c.paid_amount, 0) + db.bindparam('added')
+        ),
+        [{'invoice_pk': invoice_id, 'added': added} for invoice_id, added in invoice_totals.items()]
+    )
+    db.session.execute(
+        invoices.update().where(invoices.c.id.in_(list(invoice_totals))).values(
+            status=db.case(
+                (invoices.c.paid_amount >= invoices.c.total_amount, 'Paid'),
+                (invoices.c.paid_amount > 0, 'Partially Paid'),
+                else_=invoices.c.status
+            )
+        )
+    )
+    update_student_balances([dict(delta, student_id=student_id) for student_id, delta in student_deltas.items()])
+    update_finance_rollups(payments=[
+        (payment['payment_date'], payment['payment_method'], payment['amount']) for payment in batch
+    ])
+
+def import_bank_statement(stream, filename, recorded_by, batch_size=2000):
+    """Match bank statement rows to invoices and record them as payments.
+
+    Rows are matched on invoice_number (or reference), then on admission_number
+    against the student's oldest open invoice. Rows whose transaction_id has
+    already been recorded are treated as duplicates. Rows that match nothing,
+    match a paid invoice or exceed the matched invoice's balance are written to
+    an exceptions CSV for review, so no payment can overpay an invoice. Matched
+    payments are written in batches but committed once, so a failed import
+    leaves nothing applied and the statement can simply be uploaded again.
+    Returns a summary dict.
+    """
+    by_number, open_by_admission, seen_transactions = build_payment_match_index()
+    summary = {'rows': 0, 'matched': 0, 'amount': 0.0, 'exceptions': 0, 'exceptions_file': None}
+    exceptions = []
+    matched = []
+    
+    for row_number, row in iter_upload_rows(stream, filename):
+        summary['rows'] += 1
+        payment_date = parse_upload_date(row.get('payment_date', row.get('date')))
+        amount = parse_upload_amount(row.get('amount'))
+        transaction_id = _clean_cell(row.get('transaction_id'))
+        invoice_number = _clean_cell(row.get('invoice_number') or row.get('reference')).upper()
+        admission_number = _clean_cell(row.get('admission_number')).upper()
+        
+        reason = None
+        invoice = None
+        if payment_date is None:
+            reason = 'Invalid or missing date'
+        elif amount is None or amount <= 0:
+            reason = 'Invalid or missing amount'
+        elif transaction_id and transaction_id.upper() in seen_transactions:
+            reason = 'Duplicate transaction id'
+        else:
+            invoice = by_number.get(invoice_number) if invoice_number else None
+            if invoice is None and admission_number:
+                invoice = next((entry for entry in open_by_admission.get(admission_number, [])
+                                if entry['paid'] < entry['total']), None)
+            if invoice is None:
+                reason = 'No matching invoice'
+            elif invoice['status'] == 'Paid' or invoice['paid'] >= invoice['total']:
+                reason = 'Invoice is already paid'
+            elif amount > invoice['total'] - invoice['paid'] + 0.005:
+                reason = f"Amount exceeds the invoice balance of {invoice['total'] - invoice['paid']:.2f}"
+        
+        if reason:
+            exceptions.append(dict(row, row_number=row_number, reason=reason))
+            continue
+        
+        previous_status = invoice['status']
+        invoice['paid'] += amount
+        if invoice['paid'] >= invoice['total']:
+            invoice['status'] = 'Paid'
+        elif invoice['paid'] > 0:
+            invoice['status'] = 'Partially Paid'
+        if transaction_id:
+            seen_transactions.add(transaction_id.upper())
+        
+        matched.append({
+            'invoice_id': invoice['id'],
+            'payment_date': payment_date,
+            'amount': amount,
+            'payment_method': _clean_cell(row.get('payment_method')) or 'Bank Transfer',
+            'transaction_id': transaction_id,
+            'notes': _clean_cell(row.get('narration') or row.get('description')),
+            'recorded_by': recorded_by,
+            '_student_id': invoice['student_id'],
+            '_cleared_unpaid': 1 if previous_status == 'Unpaid' and invoice['status'] != 'Unpaid' else 0
+        })
+        summary['matched'] += 1
+        summary['amount'] += amount
+    
+    if matched:
+        # Reserve every receipt number before the first write, while the session holds no write lock
+        receipt_numbers = reserve_document_numbers('RCPT', len(matched))
+        for start in range(0, len(matched), batch_size):
+            _write_payment_batch(matched[start:start + batch_size], receipt_numbers[start:start + batch_size])
+        db.session.commit()
+        invalidate_finance_cache()
+    
+    if exceptions:
+        fieldnames = ['row_number', 'reason'] + [key for key in exceptions[0] if key not in ('row_number', 'reason')]
+        write_import_errors(summary, PAYMENT_IMPORT_FOLDER, 'exceptions', exceptions, fieldnames, key='exceptions')
+    return summary
+
+# Finance rollups
+def _add_to_rollup(model, key_column, count_column, entries):
+    """Upsert (day, key, amount) entries into a daily rollup table as increments"""
+    totals = {}
+    for day, key, amount in entries:
+        bucket = totals.setdefault((day, key or ''), [0, 0])
+        bucket[0] += 1
+        bucket[1] += amount or 0
+    if not totals:
+        return
+    
+    stmt = sqlite_insert(model)
+    count_attr = getattr(model, count_column)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.day, getattr(model, key_column)],
+        set_={
+            count_column: count_attr + getattr(stmt.excluded, count_column),
+            'total_amount': model.total_amount + stmt.excluded.total_amount
+        }
+    )
+    db.session.execute(stmt, [
+        {'day': day, key_column: key, count_column: count, 'total_amount': amount}
+        for (day, key), (count, amount) in totals.items()
+    ])
+
+def update_finance_rollups(payments=(), items=()):
+    """Add new payments and invoice items to the daily rollups in the current transaction.
+
+    payments are (payment_date, payment_method, amount) tuples and items are
+    (issue_date, item_type, amount * quantity) tuples.
+    """
+    _add_to_rollup(PaymentRollup, 'payment_method', 'payment_count', payments)
+    _add_to_rollup(InvoiceItemRollup, 'item_type', 'item_count', items)
+
+def backfill_finance_rollups():
+    """Rebuild both rollup tables from the full payment and invoice item history"""
+    payment_day = db.func.coalesce(Payment.payment_date, db.func.date(Payment.created_at))
+    payment_method = db.func.coalesce(Payment.payment_method, '')
+    item_day = db.func.coalesce(Invoice.issue_date, db.func.date(Invoice.created_at))
+    item_type = db.func.coalesce(InvoiceItem.item_type, '')
+    
+    db.session.execute(db.delete(PaymentRollup))
+    db.session.execute(db.delete(InvoiceItemRollup))
+    db.session.execute(db.insert(PaymentRollup).from_select(
+        ['day', 'payment_method', 'payment_count', 'total_amount'],
+        db.select(
+            payment_day, payment_method, db.func.count(Payment.id),
+            db.func.coalesce(db.func.sum(Payment.amount), 0)
+        ).group_by(payment_day, payment_method)
+    ))
+    db.session.execute(db.insert(InvoiceItemRollup).from_select(
+        ['day', 'item_type', 'item_count', 'total_amount'],
+        db.select(
+            item_day, item_type, db.func.count(InvoiceItem.id),
+            db.func.coalesce(db.func.sum(InvoiceItem.amount * db.func.coalesce(InvoiceItem.quantity, 1)), 0)
+        ).join(Invoice, Invoice.id == InvoiceItem.invoice_id).group_by(item_day, item_type)
+    ))
+    db.session.commit()
+    invalidate_finance_cache()
+    return PaymentRollup.query.count(), InvoiceItemRollup.query.count()
+
+@app.cli.command('backfill-finance-rollups')
+def backfill_finance_rollups_command():
+    """Rebuild the daily payment and invoice item rollups from history"""
+    payment_rows, item_rows = backfill_finance_rollups()
+    click.echo(f'Built {payment_rows} payment rollup rows and {item_rows} invoice item rollup rows')
+
+def monthly_finance_trend(months=12):
+    """Billed and collected totals per month for the last few months, read from the rollups"""
     today = datetime.now().date()
-    upcoming_invoices = []
-    invoices = Invoice.query.filter(
+    start = today.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    
+    trend = {}
+    month = start
+    while month <= today:
+        trend[month.strftime('%Y-%m')] = {'month': month.strftime('%b %Y'), 'billed': 0, 'collected': 0}
+        month = (month + timedelta(days=32)).replace(day=1)
+    
+    for day, amount in db.session.query(PaymentRollup.day, PaymentRollup.total_amount).filter(PaymentRollup.day >= start):
+        if day.strftime('%Y-%m') in trend:
+            trend[day.strftime('%Y-%m')]['collected'] += amount
+    for day, amount in db.session.query(InvoiceItemRollup.day, InvoiceItemRollup.total_amount).filter(InvoiceItemRollup.day >= start):
+        if day.strftime('%Y-%m') in trend:
+            trend[day.strftime('%Y-%m')]['billed'] += amount
+    return list(trend.values())
+
+# Finance KPIs
+finance_cache = TTLCache(ttl=60)
+
+def invalidate_finance_cache():
+    """Drop cached finance figures; call after committing invoice or payment writes"""
+    finance_cache.invalidate()
+
+def _compute_finance_kpis():
+    invoice_count, total_billed, total_paid = db.session.query(
+        db.func.count(Invoice.id),
+        db.func.coalesce(db.func.sum(Invoice.total_amount), 0),
+        db.func.coalesce(db.func.sum(Invoice.paid_amount), 0)
+    ).one()
+    return {
+        'invoice_count': invoice_count,
+        'total_billed': total_billed,
+        'total_paid': total_paid,
+        'total_outstanding': total_billed - total_paid
+    }
+
+def get_finance_kpis():
+    """Invoice count, billed, paid and outstanding totals from one cached aggregate"""
+    return finance_cache.get_or_compute('kpis', _compute_finance_kpis)
+
+def _compute_upcoming_invoices(today):
+    rows = db.session.query(
+        Invoice.invoice_number, Invoice.total_amount, Invoice.due_date, Invoice.status,
+        User.first_name, User.last_name
+    ).join(
+        Student, Student.id == Invoice.student_id
+    ).join(
+        User, User.id == Student.user_id
+    ).filter(
         Invoice.due_date >= today,
         Invoice.due_date <= today + timedelta(days=30),
         Invoice.status != 'Paid'
     ).order_by(Invoice.due_date).limit(10).all()
+    return [{
+        'invoice_number': row.invoice_number,
+        'student_name': f"{row.first_name} {row.last_name}",
+        'total_amount': row.total_amount,
+        'due_date': row.due_date,
+        'status': row.status
+    } for row in rows]
+
+def get_upcoming_invoices():
+    """Unpaid invoices due in the next 30 days, with student names, from the finance cache"""
+    today = datetime.now().date()
+    return finance_cache.get_or_compute(('upcoming', today), lambda: _compute_upcoming_invoices(today))
+
+# Receivables aging
+AGING_BUCKETS = [
+    ('current', 'Not yet due'),
+    ('days_0_30', '0-30 days'),
+    ('days_31_60', '31-60 days'),
+    ('days_61_90', '61-90 days'),
+    ('days_90_plus', '90+ days')
+]
+
+AGING_DIMENSIONS = {
+    'class_name': Student.class_name,
+    'sponsorship_type': Student.sponsorship_type,
+    'academic_year': Invoice.academic_year
+}
+
+def aging_report(group_by='class_name', as_of=None, filters=None):
+    """Bucket unpaid invoice balances by days past due_date in one grouped SQL query.
+
+    group_by is one of AGING_DIMENSIONS or 'student' for drill-down, and filters
+    maps dimension names to values to narrow the report. Bucket edges are computed
+    as dates up front so the query only compares due_date against constants.
+    """
+    as_of = as_of or datetime.now().date()
+    outstanding = db.func.coalesce(Invoice.total_amount, 0) - db.func.coalesce(Invoice.paid_amount, 0)
+    due = Invoice.due_date
+    edges = [as_of - timedelta(days=days) for days in (30, 60, 90)]
+    conditions = {
+        'current': db.or_(due.is_(None), due > as_of),
+        'days_0_30': db.and_(due <= as_of, due >= edges[0]),
+        'days_31_60': db.and_(due < edges[0], due >= edges[1]),
+        'days_61_90': db.and_(due < edges[1], due >= edges[2]),
+        'days_90_plus': due < edges[2]
+    }
+    bucket_columns = [
+        db.func.coalesce(db.func.sum(db.case((conditions[key], outstanding), else_=0)), 0).label(key)
+        for key, _ in AGING_BUCKETS
+    ]
     
-    for invoice in invoices:
-        student = Student.query.get(invoice.student_id)
-        user = User.query.get(student.user_id)
-        upcoming_invoices.append({
-            'invoice_number': invoice.invoice_number,
-            'student_name': f"{user.first_name} {user.last_name}",
-            'total_amount': invoice.total_amount,
-            'due_date': invoice.due_date,
-            'status': invoice.status
-        })
+    if group_by == 'student':
+        group_columns = [Student.id.label('student_id'), Student.admission_number, User.first_name, User.last_name]
+    else:
+        group_columns = [AGING_DIMENSIONS[group_by].label(group_by)]
+    
+    query = db.session.query(
+        *group_columns,
+        db.func.count(Invoice.id).label('invoice_count'),
+        db.func.sum(outstanding).label('total_outstanding'),
+        *bucket_columns
+    ).join(Student, Student.id == Invoice.student_id)
+    if group_by == 'student':
+        query = query.join(User, User.id == Student.user_id)
+    query = query.filter(Invoice.status != 'Paid', outstanding > 0)
+    for name, value in (filters or {}).items():
+        if value:
+            query = query.filter(AGING_DIMENSIONS[name] == value)
+    
+    rows = [row._asdict() for row in query.group_by(*group_columns).order_by(db.desc('total_outstanding'))]
+    totals = {key: sum(row[key] for row in rows) for key, _ in AGING_BUCKETS}
+    totals['total_outstanding'] = sum(row['total_outstanding'] for row in rows)
+    totals['invoice_count'] = sum(row['invoice_count'] for row in rows)
+    return rows, totals
+
+def aging_report_csv(rows, group_by):
+    """Render aging report rows as CSV text"""
+    if group_by == 'student':
+        columns = ['admission_number', 'first_name', 'last_name']
+    else:
+        columns = [group_by]
+    columns += ['invoice_count', 'total_outstanding'] + [key for key, _ in AGING_BUCKETS]
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+# Account Department Routes
+@app.route('/accounts/dashboard')
+@login_required
+@accounts_required
+def accounts_dashboard():
+    kpis = get_finance_kpis()
+    
+    # Get upcoming invoices due in the next 30 days
+    upcoming_invoices = get_upcoming_invoices()
     
     return render_template('accounts_dashboard.html',
-                          invoice_count=invoice_count,
-                          total_billed=total_billed,
-                          total_paid=total_paid,
-                          total_outstanding=total_outstanding,
+                          invoice_count=kpis['invoice_count'],
+                          total_billed=kpis['total_billed'],
+                          total_paid=kpis['total_paid'],
+                          total_outstanding=kpis['total_outstanding'],
                           upcoming_invoices=upcoming_invoices)
 
 @app.route('/accounts/invoices')
 @login_required
 @accounts_required
 def accounts_invoices():
-    invoices = Invoice.query.order_by(Invoice.issue_date.desc()).all()
-    return render_template('accounts_invoices.html', invoices=invoices)
+    filters = {
+        'status': request.args.get('status') or None,
+        'semester': request.args.get('semester') or None,
+        'academic_year': request.args.get('academic_year') or None,
+        'date_from': get_date_arg('date_from'),
+        'date_to': get_date_arg('date_to')
+    }
+    
+    query = Invoice.query.options(db.joinedload(Invoice.student).joinedload(Student.user))
+    if filters['status']:
+        query = query.filter(Invoice.status == filters['status'])
+    if filters['semester']:
+        query = query.filter(Invoice.semester == filters['semester'])
+    if filters['academic_year']:
+        query = query.filter(Invoice.academic_year == filters['academic_year'])
+    if filters['date_from']:
+        query = query.filter(Invoice.issue_date >= filters['date_from'])
+    if filters['date_to']:
+        query = query.filter(Invoice.issue_date <= filters['date_to'])
+    
+    page = keyset_page(
+        query,
+        [(INVOICE_LIST_DATE, True), (Invoice.id, True)],
+        key=lambda invoice: (invoice.issue_date or invoice.created_at.date(), invoice.id),
+        cursor=request.args.get('cursor'),
+        per_page=get_per_page()
+    )
+    return render_template('accounts_invoices.html',
+                          invoices=page.items,
+                          next_cursor=page.next_cursor,
+                          filters=filters)
 
 @app.route('/accounts/create_invoice', methods=['GET', 'POST'])
 @login_required
@@ -451,8 +1727,7 @@ def accounts_create_invoice():
         academic_year = request.form.get('academic_year')
         
         # Generate invoice number
-        latest_invoice = Invoice.query.order_by(Invoice.id.desc()).first()
-        invoice_number = f"INV-{datetime.now().year}-{latest_invoice.id + 1 if latest_invoice else 1:04d}"
+        invoice_number = next_document_number('INV')
         
         # Create invoice
         new_invoice = Invoice(
@@ -471,6 +1746,7 @@ def accounts_create_invoice():
         
         # Add invoice items
         total_amount = 0
+        item_totals = []
         item_count = int(request.form.get('item_count', 0))
         
         for i in range(1, item_count + 1):
@@ -489,16 +1765,23 @@ def accounts_create_invoice():
                 )
                 db.session.add(item)
                 total_amount += amount * quantity
+                item_totals.append((issue_date, item_type, amount * quantity))
         
         # Update invoice total
         new_invoice.total_amount = total_amount
+        update_student_balances([{
+            'student_id': new_invoice.student_id,
+            'total_billed': total_amount,
+            'unpaid_invoice_count': 1
+        }])
+        update_finance_rollups(items=item_totals)
         
         db.session.commit()
+        invalidate_finance_cache()
         flash('Invoice created successfully', 'success')
         return redirect(url_for('accounts_invoices'))
     
-    students = Student.query.all()
-    return render_template('accounts_create_invoice.html', students=students)
+    return render_template('accounts_create_invoice.html', **student_picker_context())
 
 @app.route('/accounts/record_payment', methods=['GET', 'POST'])
 @login_required
@@ -513,8 +1796,7 @@ def accounts_record_payment():
         notes = request.form.get('notes', '')
         
         # Generate receipt number
-        latest_payment = Payment.query.order_by(Payment.id.desc()).first()
-        receipt_number = f"RCPT-{datetime.now().year}-{latest_payment.id + 1 if latest_payment else 1:04d}"
+        receipt_number = next_document_number('RCPT')
         
         # Record payment
         new_payment = Payment(
@@ -532,6 +1814,7 @@ def accounts_record_payment():
         
         # Update invoice paid amount and status
         invoice = Invoice.query.get(invoice_id)
+        previous_status = invoice.status
         invoice.paid_amount += amount
         
         if invoice.paid_amount >= invoice.total_amount:
@@ -539,7 +1822,16 @@ def accounts_record_payment():
         elif invoice.paid_amount > 0:
             invoice.status = 'Partially Paid'
         
+        update_student_balances([{
+            'student_id': invoice.student_id,
+            'total_paid': amount,
+            'unpaid_invoice_count': -1 if previous_status == 'Unpaid' and invoice.status != 'Unpaid' else 0,
+            'last_payment_date': payment_date
+        }])
+        update_finance_rollups(payments=[(payment_date, payment_method, amount)])
+        
         db.session.commit()
+        invalidate_finance_cache()
         flash('Payment recorded successfully', 'success')
         return redirect(url_for('accounts_payments'))
     
@@ -547,76 +1839,347 @@ def accounts_record_payment():
     invoices = Invoice.query.filter(Invoice.status != 'Paid').all()
     return render_template('accounts_record_payment.html', invoices=invoices)
 
+@app.route('/accounts/import_payments', methods=['GET', 'POST'])
+@login_required
+@accounts_required
+def accounts_import_payments():
+    if request.method == 'POST':
+        file = request.files.get('statement_file')
+        if not file or file.filename == '':
+            flash('No selected file', 'danger')
+            return redirect(request.url)
+        
+        try:
+            summary = import_bank_statement(file.stream, file.filename, current_user.id)
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error importing bank statement: {str(e)}', 'danger')
+            return redirect(request.url)
+        
+        flash(f"Recorded {summary['matched']} of {summary['rows']} statement rows as payments", 'success')
+        if summary['exceptions']:
+            flash(f"{summary['exceptions']} rows could not be matched and were saved for review", 'warning')
+        return render_template('accounts_import_payments.html', summary=summary)
+    
+    return render_template('accounts_import_payments.html', summary=None)
+
+@app.route('/accounts/import_payments/exceptions/<path:filename>')
+@login_required
+@accounts_required
+def accounts_payment_exceptions(filename):
+    return send_from_directory(PAYMENT_IMPORT_FOLDER, secure_filename(filename), as_attachment=True)
+
 @app.route('/accounts/payments')
 @login_required
 @accounts_required
 def accounts_payments():
-    payments = Payment.query.order_by(Payment.payment_date.desc()).all()
-    return render_template('accounts_payments.html', payments=payments)
+    filters = {
+        'payment_method': request.args.get('payment_method') or None,
+        'status': request.args.get('status') or None,
+        'semester': request.args.get('semester') or None,
+        'academic_year': request.args.get('academic_year') or None,
+        'date_from': get_date_arg('date_from'),
+        'date_to': get_date_arg('date_to')
+    }
+    
+    query = Payment.query.join(Payment.invoice).options(
+        db.contains_eager(Payment.invoice).joinedload(Invoice.student).joinedload(Student.user),
+        db.joinedload(Payment.recorder)
+    )
+    if filters['payment_method']:
+        query = query.filter(Payment.payment_method == filters['payment_method'])
+    if filters['status']:
+        query = query.filter(Invoice.status == filters['status'])
+    if filters['semester']:
+        query = query.filter(Invoice.semester == filters['semester'])
+    if filters['academic_year']:
+        query = query.filter(Invoice.academic_year == filters['academic_year'])
+    if filters['date_from']:
+        query = query.filter(Payment.payment_date >= filters['date_from'])
+    if filters['date_to']:
+        query = query.filter(Payment.payment_date <= filters['date_to'])
+    
+    page = keyset_page(
+        query,
+        [(PAYMENT_LIST_DATE, True), (Payment.id, True)],
+        key=lambda payment: (payment.payment_date or payment.created_at.date(), payment.id),
+        cursor=request.args.get('cursor'),
+        per_page=get_per_page()
+    )
+    return render_template('accounts_payments.html',
+                          payments=page.items,
+                          next_cursor=page.next_cursor,
+                          filters=filters)
 
 @app.route('/accounts/financial_summary')
 @login_required
 @accounts_required
 def accounts_financial_summary():
     # Overall summary
-    total_billed = db.session.query(db.func.sum(Invoice.total_amount)).scalar() or 0
-    total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).scalar() or 0
-    total_outstanding = total_billed - total_paid
+    kpis = get_finance_kpis()
+    total_billed = kpis['total_billed']
+    total_paid = kpis['total_paid']
+    total_outstanding = kpis['total_outstanding']
     
     # Get payment methods breakdown
     payment_methods = db.session.query(
-        Payment.payment_method,
-        db.func.sum(Payment.amount).label('total')
-    ).group_by(Payment.payment_method).all()
+        db.func.nullif(PaymentRollup.payment_method, '').label('payment_method'),
+        db.func.sum(PaymentRollup.total_amount).label('total')
+    ).group_by(PaymentRollup.payment_method).all()
     
     # Get item type breakdown
     item_types = db.session.query(
-        InvoiceItem.item_type,
-        db.func.sum(InvoiceItem.amount * InvoiceItem.quantity).label('total')
-    ).group_by(InvoiceItem.item_type).all()
+        db.func.nullif(InvoiceItemRollup.item_type, '').label('item_type'),
+        db.func.sum(InvoiceItemRollup.total_amount).label('total')
+    ).group_by(InvoiceItemRollup.item_type).all()
     
     return render_template('accounts_financial_summary.html',
                           total_billed=total_billed,
                           total_paid=total_paid,
                           total_outstanding=total_outstanding,
                           payment_methods=payment_methods,
-                          item_types=item_types)
+                          item_types=item_types,
+                          monthly_trend=monthly_finance_trend())
+
+def outstanding_balances_query(class_name=None, semester=None, academic_year=None):
+    """Build one query of per-student billed, paid and balance totals.
+
+    Without semester or academic year filters the totals come straight from the
+    StudentBalance summary; otherwise they are aggregated over matching invoices.
+    """
+    if semester or academic_year:
+        billed = db.func.coalesce(db.func.sum(Invoice.total_amount), 0)
+        paid = db.func.coalesce(db.func.sum(Invoice.paid_amount), 0)
+        totals = db.session.query(
+            Invoice.student_id.label('student_id'),
+            billed.label('total_billed'),
+            paid.label('total_paid'),
+            (billed - paid).label('balance')
+        )
+        if semester:
+            totals = totals.filter(Invoice.semester == semester)
+        if academic_year:
+            totals = totals.filter(Invoice.academic_year == academic_year)
+        totals = totals.group_by(Invoice.student_id).subquery()
+    else:
+        totals = StudentBalance.__table__
+    
+    query = db.session.query(
+        totals.c.student_id,
+        totals.c.total_billed,
+        totals.c.total_paid,
+        totals.c.balance,
+        Student.admission_number,
+        Student.class_name,
+        User.first_name,
+        User.last_name
+    ).join(
+        Student, Student.id == totals.c.student_id
+    ).join(
+        User, User.id == Student.user_id
+    ).filter(totals.c.balance > 0)
+    
+    if class_name:
+        query = query.filter(Student.class_name == class_name)
+    return query, totals
 
 @app.route('/accounts/outstanding')
 @login_required
 @accounts_required
 def accounts_outstanding():
-    # Get students with outstanding balances
-    outstanding_data = []
-    
-    students = Student.query.all()
-    for student in students:
-        # Calculate student's total billing and payment
-        total_billed = db.session.query(db.func.sum(Invoice.total_amount)).filter_by(student_id=student.id).scalar() or 0
-        total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).filter_by(student_id=student.id).scalar() or 0
-        
-        if total_billed > total_paid:
-            user = User.query.get(student.user_id)
-            outstanding_data.append({
-                'student_id': student.id,
-                'name': f"{user.first_name} {user.last_name}",
-                'admission_number': student.admission_number,
-                'total_billed': total_billed,
-                'total_paid': total_paid,
-                'balance': total_billed - total_paid
-            })
+    # Get students with outstanding balances, one page at a time
+    filters = {
+        'class_name': request.args.get('class_name') or None,
+        'semester': request.args.get('semester') or None,
+        'academic_year': request.args.get('academic_year') or None
+    }
+    sort = request.args.get('sort', 'balance_desc')
+    
+    query, totals = outstanding_balances_query(**filters)
+    page = keyset_page(
+        query,
+        [(totals.c.balance, sort != 'balance_asc'), (totals.c.student_id, False)],
+        key=lambda row: (row.balance, row.student_id),
+        cursor=request.args.get('cursor'),
+        per_page=get_per_page()
+    )
     
-    return render_template('accounts_outstanding.html', outstanding_data=outstanding_data)
+    outstanding_data = [{
+        'student_id': row.student_id,
+        'name': f"{row.first_name} {row.last_name}",
+        'admission_number': row.admission_number,
+        'class_name': row.class_name,
+        'total_billed': row.total_billed,
+        'total_paid': row.total_paid,
+        'balance': row.balance
+    } for row in page.items]
+    
+    return render_template('accounts_outstanding.html',
+                          outstanding_data=outstanding_data,
+                          next_cursor=page.next_cursor,
+                          sort=sort,
+                          filters=filters)
 
 @app.route('/accounts/financial_reports')
 @login_required
 @accounts_required
 def accounts_financial_reports():
-    return render_template('accounts_financial_reports.html')
+    group_by = request.args.get('group_by', 'class_name')
+    if group_by != 'student' and group_by not in AGING_DIMENSIONS:
+        group_by = 'class_name'
+    filters = {name: request.args.get(name) or None for name in AGING_DIMENSIONS}
+    as_of = get_date_arg('as_of') or datetime.now().date()
+    
+    rows, totals = aging_report(group_by=group_by, as_of=as_of, filters=filters)
+    
+    if request.args.get('format') == 'csv':
+        filename = f"aging_report_{group_by}_{as_of.isoformat()}.csv"
+        return Response(
+            aging_report_csv(rows, group_by),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    return render_template('accounts_financial_reports.html',
+                          aging_rows=rows,
+                          aging_totals=totals,
+                          aging_buckets=AGING_BUCKETS,
+                          group_by=group_by,
+                          filters=filters,
+                          as_of=as_of)
+
+@app.route('/accounts/fee_templates', methods=['GET', 'POST'])
+@login_required
+@accounts_required
+def accounts_fee_templates():
+    if request.method == 'POST':
+        action = request.form.get('action')
+        
+        if action == 'create':
+            try:
+                template = FeeTemplate(
+                    class_name=request.form.get('class_name'),
+                    section=request.form.get('section') or None,
+                    sponsorship_type=request.form.get('sponsorship_type') or None,
+                    description=request.form.get('description'),
+                    item_type=request.form.get('item_type'),
+                    amount=float(request.form.get('amount')),
+                    quantity=int(request.form.get('quantity', 1))
+                )
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': 'Invalid amount or quantity'})
+            
+            if not template.class_name or not template.description:
+                return jsonify({'success': False, 'message': 'Class and description are required'})
+            
+            db.session.add(template)
+            db.session.commit()
+            return jsonify({'success': True, 'message': 'Fee template created successfully'})
+        
+        elif action == 'deactivate':
+            template = FeeTemplate.query.get(request.form.get('template_id'))
+            if not template:
+                return jsonify({'success': False, 'message': 'Fee template not found'})
+            
+            template.is_active = False
+            db.session.commit()
+            return jsonify({'success': True, 'message': 'Fee template deactivated'})
+        
+        return jsonify({'success': False, 'message': 'Invalid action'})
+    
+    templates = FeeTemplate.query.filter_by(is_active=True).order_by(
+        FeeTemplate.class_name, FeeTemplate.section, FeeTemplate.item_type
+    ).all()
+    billing_runs = BillingRun.query.order_by(BillingRun.created_at.desc()).limit(20).all()
+    return render_template('accounts_fee_templates.html', templates=templates, billing_runs=billing_runs)
+
+@app.route('/accounts/billing_runs/<int:run_id>')
+@login_required
+@accounts_required
+def accounts_billing_run_status(run_id):
+    run = BillingRun.query.get_or_404(run_id)
+    return jsonify({
+        'id': run.id,
+        'semester': run.semester,
+        'academic_year': run.academic_year,
+        'status': run.status,
+        'total_students': run.total_students,
+        'processed_students': run.processed_students,
+        'invoices_created': run.invoices_created,
+        'error': run.error
+    })
+
+def _duplicate_rows(table, index):
+    """Condition matching rows a unique index would reject, all but the newest of each key"""
+    present = db.and_(*[column.isnot(None) for column in index.columns])
+    newest = db.select(db.func.max(table.c.id)).where(present).group_by(*index.columns)
+    return db.and_(present, table.c.id.notin_(newest))
+
+def _missing_indexes():
+    """Yield (table, index) for indexes declared on models but absent from the database"""
+    # Read index names from sqlite_master, since reflection skips expression indexes
+    with db.engine.connect() as conn:
+        existing = set(conn.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                yield table, index
+
+def ensure_indexes():
+    """Create indexes declared on models that create_all skipped because their table already existed.
+
+    A unique index is not created while its table still holds duplicate keys; a
+    warning names the table and the remove-duplicate-rows command that clears them.
+    """
+    for table, index in _missing_indexes():
+        if index.unique and 'id' in table.c:
+            with db.engine.connect() as conn:
+                duplicates = conn.execute(
+                    db.select(db.func.count()).select_from(table).where(_duplicate_rows(table, index))
+                ).scalar()
+            if duplicates:
+                app.logger.warning(
+                    "Not creating unique index %s: %s has %d duplicate rows. "
+                    "Run 'flask remove-duplicate-rows' to keep the newest row of each key.",
+                    index.name, table.name, duplicates
+                )
+                continue
+        index.create(db.engine)
+
+@app.cli.command('remove-duplicate-rows')
+def remove_duplicate_rows_command():
+    """Delete rows blocking a pending unique index, keeping the newest of each key, then create the indexes"""
+    for table, index in list(_missing_indexes()):
+        if not (index.unique and 'id' in table.c):
+            continue
+        duplicates = _duplicate_rows(table, index)
+        if table is Attendance.__table__:
+            first_date, last_date = db.session.query(
+                db.func.min(table.c.date), db.func.max(table.c.date)
+            ).filter(duplicates).one()
+        removed = db.session.execute(table.delete().where(duplicates)).rowcount
+        if not removed:
+            continue
+        if table is Attendance.__table__:
+            bump_data_version('attendance')
+            mark_attendance_risk_stale(first_date, last_date)
+        elif table is ExamResult.__table__:
+            invalidate_exam_statistics()
+        db.session.commit()
+        click.echo(f'Removed {removed} duplicate rows from {table.name}')
+    ensure_indexes()
 
 # Create database tables
 with app.app_context():
     db.create_all()
+    ensure_indexes()
+    
+    # Populate the ledger summary for databases created before it existed
+    if StudentBalance.query.first() is None and Invoice.query.first() is not None:
+        rebuild_student_balances()
+    if PaymentRollup.query.first() is None and InvoiceItemRollup.query.first() is None \
+            and Invoice.query.first() is not None:
+        backfill_finance_rollups()
 
 # Routes
 @app.route('/')
@@ -771,9 +2334,10 @@ def student_financial():
         return redirect(url_for('dashboard'))
     
     # Get financial summary
-    total_billed = db.session.query(db.func.sum(Invoice.total_amount)).filter_by(student_id=student.id).scalar() or 0
-    total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).filter_by(student_id=student.id).scalar() or 0
-    balance = total_billed - total_paid
+    summary = get_student_balance(student.id)
+    total_billed = summary.total_billed
+    total_paid = summary.total_paid
+    balance = summary.balance
     
     # Get recent payments
     recent_payments = db.session.query(Payment, Invoice).join(
@@ -817,10 +2381,7 @@ def print_exam_slip():
     ).all()
     
     # Check financial clearance
-    unpaid_invoices = Invoice.query.filter_by(
-        student_id=student.id,
-        status='Unpaid'
-    ).count()
+    unpaid_invoices = get_student_balance(student.id).unpaid_invoice_count
     
     financial_clearance = unpaid_invoices == 0
     
@@ -860,10 +2421,7 @@ def generate_exam_slip(exam_id):
         return redirect(url_for('print_exam_slip'))
     
     # Check financial clearance
-    unpaid_invoices = Invoice.query.filter_by(
-        student_id=student.id,
-        status='Unpaid'
-    ).count()
+    unpaid_invoices = get_student_balance(student.id).unpaid_invoice_count
     
     financial_clearance = unpaid_invoices == 0
     
@@ -947,33 +2505,9 @@ def dashboard():
         
         student = Student.query.filter_by(user_id=current_user.id).first()
         if student:
-            # Get current month attendance
-            current_month = datetime.now().month
-            current_year = datetime.now().year
-            monthly_attendance = Attendance.query.filter(
-                Attendance.student_id == student.id,
-                db.extract('month', Attendance.date) == current_month,
-                db.extract('year', Attendance.date) == current_year
-            ).all()
-            
-            # Calculate statistics
-            total = len(monthly_attendance)
-            present = sum(1 for a in monthly_attendance if a.status == 'Present')
-            half_day = sum(1 for a in monthly_attendance if a.status == 'Half Day Present')
-            late = sum(1 for a in monthly_attendance if a.status == 'Late Coming')
-            absent = sum(1 for a in monthly_attendance if a.status == 'Absent')
-            
-            attendance_stats = {
-                'present': present,
-                'half_day': half_day,
-                'late': late,
-                'absent': absent,
-                'total': total,
-                'present_percent': (present / total * 100) if total > 0 else 0,
-                'half_day_percent': (half_day / total * 100) if total > 0 else 0,
-                'late_percent': (late / total * 100) if total > 0 else 0,
-                'absent_percent': (absent / total * 100) if total > 0 else 0
-            }
+            # Get attendance for the selected period (current month by default)
+            period_start, period_end, period_label = requested_attendance_period()
+            attendance_stats = student_attendance_stats(student.id, period_start, period_end)
             
             # Get exam results
             exam_results = ExamResult.query.filter_by(student_id=student.id).all()
@@ -986,13 +2520,15 @@ def dashboard():
             course_count = len(course_enrollments)
             
             # Get financial info for quick display
-            total_billed = db.session.query(db.func.sum(Invoice.total_amount)).filter_by(student_id=student.id).scalar() or 0
-            total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).filter_by(student_id=student.id).scalar() or 0
-            balance = total_billed - total_paid
+            summary = get_student_balance(student.id)
+            total_billed = summary.total_billed
+            total_paid = summary.total_paid
+            balance = summary.balance
             
             return render_template('dashboard.html', 
                                   events=events,
                                   attendance_stats=attendance_stats,
+                                  attendance_period=period_label,
                                   student=student,
                                   sponsorships=sponsorships,
                                   course_count=course_count,
@@ -1011,81 +2547,126 @@ def dashboard():
                               
     # For Accounts staff, show financial statistics
     elif current_user.role == 'accounts':
-        invoice_count = Invoice.query.count()
-        total_billed = db.session.query(db.func.sum(Invoice.total_amount)).scalar() or 0
-        total_paid = db.session.query(db.func.sum(Invoice.paid_amount)).scalar() or 0
-        total_outstanding = total_billed - total_paid
+        kpis = get_finance_kpis()
         return render_template('dashboard.html', 
                               events=events,
-                              invoice_count=invoice_count,
-                              total_billed=total_billed,
-                              total_paid=total_paid,
-                              total_outstanding=total_outstanding)
+                              invoice_count=kpis['invoice_count'],
+                              total_billed=kpis['total_billed'],
+                              total_paid=kpis['total_paid'],
+                              total_outstanding=kpis['total_outstanding'])
     
     return render_template('dashboard.html', 
                           events=events,
                           attendance_stats=attendance_stats)
 
-@app.route('/student/<int:student_id>')
-@login_required
-def student_profile(student_id):
-    student = Student.query.get_or_404(student_id)
-    user = User.query.get(student.user_id)
-    
-    # Get attendance data
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    monthly_attendance = Attendance.query.filter(
-        Attendance.student_id == student.id,
-        db.extract('month', Attendance.date) == current_month,
-        db.extract('year', Attendance.date) == current_year
-    ).all()
-    
-    # Calculate attendance statistics
-    total = len(monthly_attendance)
-    present = sum(1 for a in monthly_attendance if a.status == 'Present')
-    half_day = sum(1 for a in monthly_attendance if a.status == 'Half Day Present')
-    late = sum(1 for a in monthly_attendance if a.status == 'Late Coming')
-    absent = sum(1 for a in monthly_attendance if a.status == 'Absent')
-    
-    attendance_stats = {
-        'present': present,
-        'half_day': half_day,
-        'late': late,
-        'absent': absent,
-        'total': total,
-        'present_percent': (present / total * 100) if total > 0 else 0,
-        'half_day_percent': (half_day / total * 100) if total > 0 else 0,
-        'late_percent': (late / total * 100) if total > 0 else 0,
-        'absent_percent': (absent / total * 100) if total > 0 else 0
-    }
-    
-    # Get exam results
-    exam_results = ExamResult.query.filter_by(student_id=student.id).all()
-    exam_data = []
-    
-    for result in exam_results:
-        exam = Exam.query.get(result.exam_id)
-        exam_data.append({
+# Student profile
+# Profiles are cached per (student_id, period start, period end)
+profile_cache = TTLCache(ttl=300)
+
+def invalidate_student_profiles(student_ids):
+    """Drop cached profiles for these students once the current transaction commits"""
+    db.session.info.setdefault('stale_profiles', set()).update(int(student_id) for student_id in student_ids)
+
+@db.event.listens_for(db.session, 'after_commit')
+def _drop_stale_profiles(db_session):
+    stale = db_session.info.pop('stale_profiles', None)
+    if stale:
+        profile_cache.invalidate_if(lambda key: key[0] in stale)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_stale_profiles(db_session):
+    db_session.info.pop('stale_profiles', None)
+
+@db.event.listens_for(Student, 'after_insert')
+@db.event.listens_for(Student, 'after_update')
+@db.event.listens_for(Student, 'after_delete')
+@db.event.listens_for(ExamResult, 'after_insert')
+@db.event.listens_for(ExamResult, 'after_update')
+@db.event.listens_for(ExamResult, 'after_delete')
+def _student_row_changed(mapper, connection, target):
+    invalidate_student_profiles([target.id if isinstance(target, Student) else target.student_id])
+
+@db.event.listens_for(User, 'after_update')
+def _user_row_changed(mapper, connection, target):
+    student_ids = connection.execute(db.select(Student.id).where(Student.user_id == target.id)).scalars().all()
+    invalidate_student_profiles(student_ids)
+
+def _snapshot(obj):
+    """Plain copy of a model's column values, safe to cache across sessions"""
+    return SimpleNamespace(**{attr.key: getattr(obj, attr.key) for attr in db.inspect(obj).mapper.column_attrs})
+
+def build_student_profile(student_id, start, end):
+    """Profile data for one student from a joined student/user query, the attendance
+    aggregate and one results-with-exams query; None if the student does not exist"""
+    row = db.session.query(Student, User).outerjoin(User, Student.user_id == User.id).filter(
+        Student.id == student_id
+    ).first()
+    if row is None:
+        return None
+    student, user = _snapshot(row[0]), _snapshot(row[1]) if row[1] else None
+    student.user = user
+    
+    results = db.session.query(
+        ExamResult.id, ExamResult.grade, ExamResult.percentage, Exam.exam_type, Exam.subject, Exam.date
+    ).join(Exam, ExamResult.exam_id == Exam.id).filter(
+        ExamResult.student_id == student_id
+    ).order_by(ExamResult.id).all()
+    
+    return {
+        'student': student,
+        'user': user,
+        'attendance_stats': student_attendance_stats(student_id, start, end),
+        'exam_results': [{
             'id': f"#mar{result.id}",
-            'type': exam.exam_type,
-            'subject': exam.subject,
+            'type': result.exam_type,
+            'subject': result.subject,
             'grade': result.grade,
             'percentage': result.percentage,
-            'date': exam.date.strftime('%d %b %Y')
-        })
+            'date': result.date.strftime('%d %b %Y') if result.date else ''
+        } for result in results]
+    }
+
+def get_student_profile(student_id, start, end):
+    profile = profile_cache.get_or_compute(
+        (student_id, start, end), lambda: build_student_profile(student_id, start, end)
+    )
+    if profile is None:
+        # Don't keep a miss around; the student may be created shortly
+        profile_cache.invalidate((student_id, start, end))
+    return profile
+
+@app.route('/student/<int:student_id>')
+@login_required
+def student_profile(student_id):
+    # Get attendance for the selected period (current month by default)
+    period_start, period_end, period_label = requested_attendance_period()
+    profile = get_student_profile(student_id, period_start, period_end)
+    if profile is None:
+        abort(404)
     
     return render_template('student_profile.html', 
-                          student=student,
-                          user=user,
-                          attendance_stats=attendance_stats,
-                          exam_results=exam_data)
+                          student=profile['student'],
+                          user=profile['user'],
+                          attendance_stats=profile['attendance_stats'],
+                          attendance_period=period_label,
+                          exam_results=profile['exam_results'])
 
 @app.route('/students')
 @login_required
 def students():
-    all_students = Student.query.all()
-    return render_template('students.html', students=all_students)
+    context = student_picker_context()
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'students': [{
+                'id': student.id,
+                'name': f"{student.user.first_name} {student.user.last_name}",
+                'admission_number': student.admission_number,
+                'class_name': student.class_name,
+                'section': student.section
+            } for student in context['students']],
+            'next_cursor': context['next_cursor']
+        })
+    return render_template('students.html', **context)
 
 @app.route('/teachers')
 @login_required
@@ -1146,6 +2727,10 @@ def lecturer_course_detail(course_id):
         flash('You are not assigned to this course', 'danger')
         return redirect(url_for('lecturer_courses'))
     
+    # Attendance rates come from the maintained per-course summary
+    course_attendance, student_rates = course_attendance_rates(course.id)
+    session_count = CourseAttendanceSession.query.filter_by(course_id=course.id).count()
+    
     # Get enrolled students
     enrollments = CourseEnrollment.query.filter_by(course_id=course.id).all()
     students_data = []
@@ -1157,7 +2742,8 @@ def lecturer_course_detail(course_id):
             'id': student.id,
             'name': f"{user.first_name} {user.last_name}",
             'admission_number': student.admission_number,
-            'grade': enrollment.grade
+            'grade': enrollment.grade,
+            'attendance': student_rates.get(student.id, build_attendance_stats({}))
         })
     
     # Get course materials
@@ -1168,6 +2754,8 @@ def lecturer_course_detail(course_id):
     return render_template('lecturer_course_detail.html', 
                            course=course,
                            students=students_data,
+                           course_attendance=course_attendance,
+                           session_count=session_count,
                            notes=notes,
                            materials=materials,
                            quizzes=quizzes)
@@ -1816,57 +3404,958 @@ def events():
     all_events = Event.query.all()
     return render_template('events.html', events=all_events)
 
-@app.route('/event/<int:event_id>')
+@app.route('/event/<int:event_id>')
+@login_required
+def event_detail(event_id):
+    event = Event.query.get_or_404(event_id)
+    return render_template('event_detail.html', event=event)
+
+@app.route('/add_event', methods=['GET', 'POST'])
+@login_required
+def add_event():
+    if current_user.role != 'admin' and current_user.role != 'teacher':
+        flash('You do not have permission to add events', 'danger')
+        return redirect(url_for('events'))
+        
+    if request.method == 'POST':
+        title = request.form.get('title')
+        description = request.form.get('description')
+        date_str = request.form.get('date')
+        time_str = request.form.get('time')
+        
+        try:
+            event_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            event_time = datetime.strptime(time_str, '%H:%M').time()
+            
+            new_event = Event(
+                title=title,
+                description=description,
+                date=event_date,
+                time=event_time
+            )
+            
+            db.session.add(new_event)
+            db.session.commit()
+            
+            flash('Event added successfully', 'success')
+            return redirect(url_for('events'))
+        except Exception as e:
+            flash(f'Error adding event: {str(e)}', 'danger')
+    
+    return render_template('add_event.html')
+
+# Attendance statistics
+ATTENDANCE_STATUS_KEYS = {
+    'Present': 'present',
+    'Half Day Present': 'half_day',
+    'Late Coming': 'late',
+    'Absent': 'absent'
+}
+
+def get_academic_terms():
+    """Return the configured terms as dicts with name, academic_year, start and end dates"""
+    terms = []
+    for term in get_config_value('academic_calendar', []):
+        terms.append({
+            'name': term['name'],
+            'academic_year': term.get('academic_year'),
+            'start': date.fromisoformat(term['start']),
+            'end': date.fromisoformat(term['end'])
+        })
+    return sorted(terms, key=lambda term: term['start'])
+
+def attendance_period(period='month', today=None, start=None, end=None):
+    """Resolve a named period (month, term, year or custom) to an inclusive (start, end, label)"""
+    today = today or datetime.now().date()
+    if period == 'custom' and start and end and start <= end:
+        return start, end, f"{start.strftime('%d %b %Y')} - {end.strftime('%d %b %Y')}"
+    
+    if period in ('term', 'year'):
+        terms = get_academic_terms()
+        current = next((term for term in terms if term['start'] <= today <= term['end']), None)
+        if current is None:
+            # Between terms, report on the most recent one
+            past = [term for term in terms if term['end'] < today]
+            current = past[-1] if past else None
+        if current and period == 'term':
+            return current['start'], current['end'], current['name']
+        if current and period == 'year' and current['academic_year']:
+            year_terms = [term for term in terms if term['academic_year'] == current['academic_year']]
+            return year_terms[0]['start'], year_terms[-1]['end'], current['academic_year']
+        if period == 'year':
+            return date(today.year, 1, 1), date(today.year, 12, 31), str(today.year)
+    
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return month_start, month_end, today.strftime('%B %Y')
+
+def build_attendance_stats(counts):
+    """Turn a {status: count} mapping into the attendance_stats dict used by templates"""
+    total = sum(counts.values())
+    stats = {'total': total}
+    for status, key in ATTENDANCE_STATUS_KEYS.items():
+        stats[key] = counts.get(status, 0)
+        stats[f'{key}_percent'] = (stats[key] / total * 100) if total > 0 else 0
+    return stats
+
+def attendance_status_counts(student_id, start, end):
+    """Count a student's attendance by status between start and end inclusive, archived terms included"""
+    counts = dict(db.session.query(
+        Attendance.status, db.func.count(Attendance.id)
+    ).filter(
+        Attendance.student_id == student_id,
+        Attendance.date >= start,
+        Attendance.date <= end
+    ).group_by(Attendance.status).all())
+    
+    archive_range = db.session.query(
+        db.func.min(AttendanceArchive.start_date), db.func.max(AttendanceArchive.end_date)
+    ).filter(
+        AttendanceArchive.student_id == student_id,
+        AttendanceArchive.end_date >= start,
+        AttendanceArchive.start_date <= end
+    ).one()
+    if archive_range[0] is None:
+        return counts
+    
+    # Live rows recorded after a term was archived take precedence over the archive
+    live_dates = []
+    if counts:
+        live_dates = [live_date for (live_date,) in db.session.query(Attendance.date).filter(
+            Attendance.student_id == student_id,
+            Attendance.date >= max(start, archive_range[0]),
+            Attendance.date <= min(end, archive_range[1])
+        )]
+    for status, count in archived_status_counts(student_id, start, end, live_dates).items():
+        counts[status] = counts.get(status, 0) + count
+    return counts
+
+def student_attendance_stats(student_id, start, end):
+    """Attendance statistics for one student over an inclusive date range"""
+    return build_attendance_stats(attendance_status_counts(student_id, start, end))
+
+def requested_attendance_period():
+    """Resolve the attendance period selected in the request query string"""
+    return attendance_period(
+        request.args.get('period', 'month'),
+        start=get_date_arg('start'),
+        end=get_date_arg('end')
+    )
+
+# Attendance archive
+# Day codes stored in AttendanceArchive.data; 0 means no attendance was recorded that day
+ARCHIVE_STATUSES = [None, 'Present', 'Half Day Present', 'Late Coming', 'Absent']
+ARCHIVE_STATUS_CODES = {status: code for code, status in enumerate(ARCHIVE_STATUSES) if status}
+
+def pack_attendance_codes(codes):
+    """Pack an array of day codes into bytes, two days per byte"""
+    codes = np.asarray(codes, dtype=np.uint8)
+    if len(codes) % 2:
+        codes = np.append(codes, np.uint8(0))
+    return ((codes[0::2] << 4) | codes[1::2]).tobytes()
+
+def unpack_attendance_codes(data, days):
+    """Unpack bytes written by pack_attendance_codes into an array of day codes"""
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.empty(len(packed) * 2, dtype=np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 0x0F
+    return codes[:days]
+
+def archive_day_codes(archive, start=None, end=None):
+    """Return (first_date, codes) for the part of an archive that falls between start and end"""
+    first = max(archive.start_date, start) if start else archive.start_date
+    last = min(archive.end_date, end) if end else archive.end_date
+    if last < first:
+        return first, np.empty(0, dtype=np.uint8)
+    codes = unpack_attendance_codes(archive.data, (archive.end_date - archive.start_date).days + 1)
+    offset = (first - archive.start_date).days
+    return first, codes[offset:offset + (last - first).days + 1]
+
+def overlapping_archives(student_id, start=None, end=None):
+    """Archived terms for a student that overlap the inclusive range"""
+    query = AttendanceArchive.query.filter(AttendanceArchive.student_id == student_id)
+    if start:
+        query = query.filter(AttendanceArchive.end_date >= start)
+    if end:
+        query = query.filter(AttendanceArchive.start_date <= end)
+    return query.order_by(AttendanceArchive.start_date).all()
+
+def archived_status_counts(student_id, start, end, live_dates=()):
+    """Count archived attendance by status, skipping days that also have a live row"""
+    counts = {}
+    for archive in overlapping_archives(student_id, start, end):
+        first, codes = archive_day_codes(archive, start, end)
+        for live_date in live_dates:
+            offset = (live_date - first).days
+            if 0 <= offset < len(codes):
+                codes[offset] = 0
+        for code, count in enumerate(np.bincount(codes, minlength=len(ARCHIVE_STATUSES))):
+            if code and count:
+                counts[ARCHIVE_STATUSES[code]] = counts.get(ARCHIVE_STATUSES[code], 0) + int(count)
+    return counts
+
+AttendanceRecord = namedtuple('AttendanceRecord', ['student_id', 'date', 'status'])
+
+def student_attendance_history(student_id, start=None, end=None):
+    """All attendance for a student, newest first, merging archived terms with live rows"""
+    query = Attendance.query.filter(Attendance.student_id == student_id)
+    if start:
+        query = query.filter(Attendance.date >= start)
+    if end:
+        query = query.filter(Attendance.date <= end)
+    records = {row.date: AttendanceRecord(student_id, row.date, row.status) for row in query}
+    
+    for archive in overlapping_archives(student_id, start, end):
+        first, codes = archive_day_codes(archive, start, end)
+        for offset in np.flatnonzero(codes):
+            day = first + timedelta(days=int(offset))
+            if day not in records:
+                records[day] = AttendanceRecord(student_id, day, ARCHIVE_STATUSES[codes[offset]])
+    return sorted(records.values(), key=lambda record: record.date, reverse=True)
+
+def archive_attendance(start, end, term_name=None, chunk_size=500):
+    """Move live attendance between start and end into per-student archives.
+
+    Works through students in id order, committing each chunk so an interrupted
+    run can simply be repeated. Rows added later for an already archived term are
+    merged into the existing archive, found by student and start date so a term
+    whose end date was edited still merges. Rows whose status has no archive code
+    are left live. Returns (students, rows archived, rows skipped).
+    """
+    students_archived = rows_archived = rows_skipped = 0
+    last_student_id = 0
+    while True:
+        student_ids = [student_id for (student_id,) in db.session.query(Attendance.student_id).filter(
+            Attendance.date >= start,
+            Attendance.date <= end,
+            Attendance.student_id > last_student_id
+        ).distinct().order_by(Attendance.student_id).limit(chunk_size)]
+        if not student_ids:
+            break
+        last_student_id = student_ids[-1]
+        
+        existing = {archive.student_id: archive for archive in AttendanceArchive.query.filter(
+            AttendanceArchive.student_id.in_(student_ids),
+            AttendanceArchive.start_date == start
+        )}
+        # Cover the longer of the new range and any existing archive so no archived day is dropped
+        archive_end = max([end] + [archive.end_date for archive in existing.values()])
+        archive_days = (archive_end - start).days + 1
+        codes = {student_id: np.zeros(archive_days, dtype=np.uint8) for student_id in student_ids}
+        for archive in existing.values():
+            archived_days = (archive.end_date - start).days + 1
+            codes[archive.student_id][:archived_days] = unpack_attendance_codes(archive.data, archived_days)
+        
+        rows = db.session.query(Attendance.student_id, Attendance.date, Attendance.status).filter(
+            Attendance.student_id.in_(student_ids),
+            Attendance.date >= start,
+            Attendance.date <= end
+        ).all()
+        archived = 0
+        for student_id, attendance_date, status in rows:
+            code = ARCHIVE_STATUS_CODES.get(status)
+            if code is None:
+                continue
+            codes[student_id][(attendance_date - start).days] = code
+            archived += 1
+        
+        new_archives = []
+        for student_id, student_codes in codes.items():
+            student_end = max(end, existing[student_id].end_date) if student_id in existing else end
+            student_codes = student_codes[:(student_end - start).days + 1]
+            if student_id in existing:
+                existing[student_id].data = pack_attendance_codes(student_codes)
+                existing[student_id].end_date = student_end
+                existing[student_id].term_name = term_name or existing[student_id].term_name
+                existing[student_id].archived_at = datetime.now()
+            elif student_codes.any():
+                new_archives.append({
+                    'student_id': student_id,
+                    'term_name': term_name,
+                    'start_date': start,
+                    'end_date': end,
+                    'data': pack_attendance_codes(student_codes),
+                    'archived_at': datetime.now()
+                })
+        if new_archives:
+            db.session.execute(db.insert(AttendanceArchive), new_archives)
+        db.session.execute(db.delete(Attendance).where(
+            Attendance.student_id.in_(student_ids),
+            Attendance.date >= start,
+            Attendance.date <= end,
+            Attendance.status.in_(list(ARCHIVE_STATUS_CODES))
+        ))
+        db.session.commit()
+        students_archived += len(student_ids)
+        rows_archived += archived
+        rows_skipped += len(rows) - archived
+    return students_archived, rows_archived, rows_skipped
+
+@app.cli.command('archive-attendance')
+@click.option('--term', 'term_name', default=None, help='Name of a configured term; defaults to every closed term')
+@click.option('--chunk-size', default=500, show_default=True)
+def archive_attendance_command(term_name, chunk_size):
+    """Pack closed terms' attendance into AttendanceArchive and remove the live rows."""
+    today = datetime.now().date()
+    terms = [term for term in get_academic_terms() if term['end'] < today]
+    if term_name:
+        terms = [term for term in terms if term['name'] == term_name]
+        if not terms:
+            raise click.ClickException(f'No closed term named {term_name} in the academic calendar')
+    for term in terms:
+        students, rows, skipped = archive_attendance(term['start'], term['end'], term['name'], chunk_size)
+        click.echo(f"{term['name']}: archived {rows} rows for {students} students")
+        if skipped:
+            click.echo(f"{term['name']}: left {skipped} rows with unrecognised statuses in the live table")
+
+def upsert_attendance(records, chunk_size=1000):
+    """Insert or update daily attendance rows keyed on (student_id, date).
+
+    records are dicts with student_id, date and status; when a key repeats the last
+    status wins. Existing keys are prefetched with one index range query per chunk
+    of students so the caller can report how many rows were inserted and how many
+    updated.
+    Returns (inserted, updated) and leaves the commit to the caller.
+    """
+    latest = {}
+    for record in records:
+        latest[(int(record['student_id']), record['date'])] = record['status']
+    if not latest:
+        return 0, 0
+    
+    first_date = min(attendance_date for _, attendance_date in latest)
+    last_date = max(attendance_date for _, attendance_date in latest)
+    student_ids = sorted({student_id for student_id, _ in latest})
+    existing = set()
+    for start in range(0, len(student_ids), chunk_size):
+        existing.update(db.session.query(Attendance.student_id, Attendance.date).filter(
+            Attendance.student_id.in_(student_ids[start:start + chunk_size]),
+            Attendance.date >= first_date,
+            Attendance.date <= last_date
+        ).all())
+    updated = sum(1 for key in latest if key in existing)
+    
+    stmt = sqlite_insert(Attendance)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Attendance.student_id, Attendance.date],
+        set_={'status': stmt.excluded.status}
+    )
+    rows = [
+        {'student_id': student_id, 'date': attendance_date, 'status': status}
+        for (student_id, attendance_date), status in latest.items()
+    ]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(stmt, rows[start:start + chunk_size])
+    bump_data_version('attendance')
+    mark_attendance_risk_stale(first_date, last_date)
+    invalidate_student_profiles({student_id for student_id, _ in latest})
+    return len(rows) - updated, updated
+
+# Course attendance
+def record_course_attendance(course_id, attendance_date, period, statuses, taken_by=None):
+    """Record one course session's attendance in bulk and keep CourseAttendanceSummary in step.
+
+    statuses maps student_id to status. Existing marks for the session are
+    prefetched so only changed students are written, and the summary receives
+    +1/-1 deltas instead of being recounted. Returns (inserted, updated) and
+    leaves the commit to the caller.
+    """
+    session_row = CourseAttendanceSession.query.filter_by(
+        course_id=course_id, date=attendance_date, period=period
+    ).first()
+    if session_row is None:
+        session_row = CourseAttendanceSession(course_id=course_id, date=attendance_date,
+                                              period=period, taken_by=taken_by)
+        db.session.add(session_row)
+        db.session.flush()
+    else:
+        session_row.taken_by = taken_by
+        session_row.updated_at = datetime.now()
+    
+    existing = dict(db.session.query(CourseAttendance.student_id, CourseAttendance.status).filter_by(
+        session_id=session_row.id
+    ))
+    
+    changes = {}
+    for student_id, status in statuses.items():
+        if status in ATTENDANCE_STATUS_KEYS and existing.get(int(student_id)) != status:
+            changes[int(student_id)] = status
+    if not changes:
+        return 0, 0
+    
+    stmt = sqlite_insert(CourseAttendance)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CourseAttendance.session_id, CourseAttendance.student_id],
+        set_={'status': stmt.excluded.status}
+    )
+    db.session.execute(stmt, [
+        {'session_id': session_row.id, 'student_id': student_id, 'status': status}
+        for student_id, status in changes.items()
+    ])
+    
+    deltas = []
+    for student_id, status in changes.items():
+        delta = {'course_id': course_id, 'student_id': student_id,
+                 'present': 0, 'half_day': 0, 'late': 0, 'absent': 0, 'total': 1,
+                 'updated_at': datetime.now()}
+        delta[ATTENDANCE_STATUS_KEYS[status]] += 1
+        previous = existing.get(student_id)
+        if previous in ATTENDANCE_STATUS_KEYS:
+            delta[ATTENDANCE_STATUS_KEYS[previous]] -= 1
+            delta['total'] = 0
+        deltas.append(delta)
+    
+    stmt = sqlite_insert(CourseAttendanceSummary)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CourseAttendanceSummary.course_id, CourseAttendanceSummary.student_id],
+        set_={
+            'present': CourseAttendanceSummary.present + excluded.present,
+            'half_day': CourseAttendanceSummary.half_day + excluded.half_day,
+            'late': CourseAttendanceSummary.late + excluded.late,
+            'absent': CourseAttendanceSummary.absent + excluded.absent,
+            'total': CourseAttendanceSummary.total + excluded.total,
+            'updated_at': excluded.updated_at
+        }
+    )
+    db.session.execute(stmt, deltas)
+    
+    updated = sum(1 for student_id in changes if student_id in existing)
+    return len(changes) - updated, updated
+
+def summary_attendance_stats(summary):
+    """attendance_stats dict for a CourseAttendanceSummary row or aggregate with the same fields"""
+    return build_attendance_stats({
+        status: getattr(summary, key) or 0 for status, key in ATTENDANCE_STATUS_KEYS.items()
+    })
+
+def course_attendance_rates(course_id):
+    """Return (course_stats, {student_id: stats}) from CourseAttendanceSummary"""
+    summaries = CourseAttendanceSummary.query.filter_by(course_id=course_id).all()
+    by_student = {summary.student_id: summary_attendance_stats(summary) for summary in summaries}
+    course_counts = {}
+    for stats in by_student.values():
+        for status, key in ATTENDANCE_STATUS_KEYS.items():
+            course_counts[status] = course_counts.get(status, 0) + stats[key]
+    return build_attendance_stats(course_counts), by_student
+
+def rebuild_course_attendance_summary(course_id=None):
+    """Recompute CourseAttendanceSummary from CourseAttendance with one grouped query"""
+    key_columns = {key: db.func.sum(db.case((CourseAttendance.status == status, 1), else_=0)).label(key)
+                   for status, key in ATTENDANCE_STATUS_KEYS.items()}
+    query = db.session.query(
+        CourseAttendanceSession.course_id,
+        CourseAttendance.student_id,
+        *key_columns.values(),
+        db.func.count(CourseAttendance.id).label('total')
+    ).join(CourseAttendanceSession, CourseAttendance.session_id == CourseAttendanceSession.id)
+    summary_delete = db.delete(CourseAttendanceSummary)
+    if course_id is not None:
+        query = query.filter(CourseAttendanceSession.course_id == course_id)
+        summary_delete = summary_delete.where(CourseAttendanceSummary.course_id == course_id)
+    rows = [dict(row._mapping, updated_at=datetime.now()) for row in
+            query.group_by(CourseAttendanceSession.course_id, CourseAttendance.student_id)]
+    
+    db.session.execute(summary_delete)
+    if rows:
+        db.session.execute(db.insert(CourseAttendanceSummary), rows)
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command('rebuild-course-attendance-summary')
+@click.option('--course-id', type=int, default=None)
+def rebuild_course_attendance_summary_command(course_id):
+    """Recompute per-course attendance rates from the raw session marks."""
+    count = rebuild_course_attendance_summary(course_id)
+    click.echo(f'Rebuilt {count} course attendance summaries')
+
+# Attendance analytics
+# Weight of each status towards the attendance rate
+ATTENDANCE_RATE_WEIGHTS = {'Present': 1.0, 'Late Coming': 1.0, 'Half Day Present': 0.5, 'Absent': 0.0}
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+analytics_cache = TTLCache(ttl=3600)
+
+def load_attendance_frame(start, end):
+    """Load attendance between start and end, archived terms included, as a DataFrame.
+
+    Columns are student_id, date, status, class_name and section. Live rows
+    come from one range query; archives are decoded a whole term at a time by
+    stacking their packed arrays into a matrix, and class and section are
+    joined on from a small student frame.
+    """
+    # Read live rows straight from the DBAPI cursor: building SQLAlchemy rows and
+    # parsing dates one at a time dominates the cost at hundreds of thousands of rows
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            'SELECT student_id, date, status FROM attendance WHERE date >= ? AND date <= ?',
+            (start.isoformat(), end.isoformat())
+        )
+        live = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    archives = db.session.query(
+        AttendanceArchive.student_id, AttendanceArchive.start_date, AttendanceArchive.end_date,
+        AttendanceArchive.data
+    ).filter(
+        AttendanceArchive.end_date >= start,
+        AttendanceArchive.start_date <= end
+    ).all()
+    terms = {}
+    for row in archives:
+        terms.setdefault((row.start_date, row.end_date), []).append(row)
+    
+    frames = []
+    for (term_start, term_end), rows in terms.items():
+        packed = np.frombuffer(b''.join(row.data for row in rows), dtype=np.uint8).reshape(len(rows), -1)
+        codes = np.empty((len(rows), packed.shape[1] * 2), dtype=np.uint8)
+        codes[:, 0::2] = packed >> 4
+        codes[:, 1::2] = packed & 0x0F
+        first = (max(start, term_start) - term_start).days
+        last = (min(end, term_end) - term_start).days
+        codes = codes[:, first:last + 1]
+        row_index, day_index = np.nonzero(codes)
+        frames.append(pd.DataFrame({
+            'student_id': np.array([row.student_id for row in rows])[row_index],
+            'date': np.datetime64(term_start, 'D') + (first + day_index).astype('timedelta64[D]'),
+            'status': np.array(ARCHIVE_STATUSES, dtype=object)[codes[row_index, day_index]]
+        }))
+    
+    live_frame = pd.DataFrame(live, columns=['student_id', 'date', 'status'])
+    live_frame['date'] = pd.to_datetime(live_frame['date'], format='%Y-%m-%d')
+    frames.append(live_frame)
+    frame = pd.concat(frames, ignore_index=True)
+    if len(frames) > 1:
+        # A live row recorded after archiving overrides the archived day
+        frame = frame.drop_duplicates(['student_id', 'date'], keep='last')
+    
+    students = pd.DataFrame(
+        db.session.query(Student.id, Student.class_name, Student.section).all(),
+        columns=['student_id', 'class_name', 'section']
+    )
+    return frame.merge(students, on='student_id', how='inner')
+
+def _rate_table(frame, by):
+    """Per-group record and status counts with the weighted attendance rate"""
+    table = frame.groupby(by).agg(records=('weight', 'size'), rate=('weight', 'mean'))
+    table['rate'] = (table['rate'] * 100).round(2)
+    counts = frame.groupby(by + ['status']).size().unstack(fill_value=0)
+    for status, key in ATTENDANCE_STATUS_KEYS.items():
+        table[key] = counts[status] if status in counts else 0
+    return table.reset_index()
+
+def _records(table):
+    """DataFrame rows as plain-Python dicts ready for jsonify"""
+    return [{key: value.item() if isinstance(value, np.generic) else value for key, value in row.items()}
+            for row in table.to_dict('records')]
+
+def compute_attendance_analytics(start, end):
+    """Attendance rates by class/section and weekday, a weekly trend and a daily heatmap"""
+    frame = load_attendance_frame(start, end)
+    analytics = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'records': int(len(frame)),
+        'students': int(frame['student_id'].nunique()),
+        'rate': None,
+        'by_class': [],
+        'by_weekday': [],
+        'trend': [],
+        'heatmap': []
+    }
+    if frame.empty:
+        return analytics
+    
+    frame['weight'] = frame['status'].map(ATTENDANCE_RATE_WEIGHTS).fillna(0.0)
+    frame['class_name'] = frame['class_name'].fillna('')
+    frame['section'] = frame['section'].fillna('')
+    frame['weekday'] = frame['date'].dt.weekday
+    analytics['rate'] = round(float(frame['weight'].mean() * 100), 2)
+    
+    analytics['by_class'] = _records(_rate_table(frame, ['class_name', 'section']))
+    
+    by_weekday = _rate_table(frame, ['weekday'])
+    by_weekday['weekday'] = by_weekday['weekday'].map(WEEKDAY_NAMES.__getitem__)
+    analytics['by_weekday'] = _records(by_weekday)
+    
+    daily = _rate_table(frame, ['date'])
+    daily['date'] = daily['date'].dt.strftime('%Y-%m-%d')
+    analytics['heatmap'] = _records(daily[['date', 'records', 'rate']])
+    
+    frame['week_start'] = frame['date'] - pd.to_timedelta(frame['weekday'], unit='D')
+    weekly = _rate_table(frame, ['week_start'])
+    weekly['week_start'] = weekly['week_start'].dt.strftime('%Y-%m-%d')
+    analytics['trend'] = _records(weekly[['week_start', 'records', 'rate']])
+    return analytics
+
+def get_attendance_analytics(start, end):
+    """Cached analytics for a date range; any attendance write changes the cache key"""
+    key = (start, end, get_data_version('attendance'))
+    return analytics_cache.get_or_compute(key, lambda: compute_attendance_analytics(start, end))
+
+@app.route('/admin/attendance_analytics')
 @login_required
-def event_detail(event_id):
-    event = Event.query.get_or_404(event_id)
-    return render_template('event_detail.html', event=event)
+@admin_required
+def admin_attendance_analytics():
+    start, end, period_label = requested_attendance_period()
+    analytics = get_attendance_analytics(start, end)
+    if request.args.get('format') == 'json':
+        return jsonify(analytics)
+    return render_template('admin_attendance_analytics.html',
+                           analytics=analytics,
+                           period_label=period_label)
 
-@app.route('/add_event', methods=['GET', 'POST'])
+# Attendance register import
+ATTENDANCE_IMPORT_FOLDER = os.path.join(app.instance_path, 'attendance_imports')
+
+# Codes accepted in register cells; blank cells mean no attendance was taken
+REGISTER_STATUS_CODES = {
+    'P': 'Present', 'PRESENT': 'Present',
+    'A': 'Absent', 'ABSENT': 'Absent',
+    'L': 'Late Coming', 'LATE': 'Late Coming', 'LATE COMING': 'Late Coming',
+    'H': 'Half Day Present', 'HD': 'Half Day Present', 'HALF DAY': 'Half Day Present',
+    'HALF DAY PRESENT': 'Half Day Present'
+}
+
+def _import_register_chunk(chunk, date_columns, admission_index, errors):
+    """Unpivot a chunk of register rows and upsert it; returns (inserted, updated)"""
+    frame = pd.DataFrame([values for _, values in chunk])
+    frame.index = [row_number for row_number, _ in chunk]
+    frame = frame.reindex(columns=range(max(date_columns) + 1))
+    
+    admission = frame[0].astype(str).str.strip().str.upper()
+    student_ids = admission.map(admission_index)
+    for row_number, value in admission[student_ids.isna()].items():
+        errors.append({'row_number': row_number, 'column': 'admission_number', 'value': value,
+                       'reason': 'Unknown admission number'})
+    
+    cells = frame.loc[student_ids.notna(), list(date_columns)]
+    cells.columns = [date_columns[column] for column in cells.columns]
+    cells.index = pd.MultiIndex.from_arrays(
+        [cells.index, student_ids[student_ids.notna()].astype(int)], names=['row_number', 'student_id']
+    )
+    long = cells.stack(future_stack=True).dropna()
+    long = long.astype(str).str.strip()
+    long = long[long != '']
+    statuses = long.str.upper().map(REGISTER_STATUS_CODES)
+    
+    invalid = long[statuses.isna()]
+    for (row_number, _, attendance_date), value in invalid.items():
+        errors.append({'row_number': row_number, 'column': attendance_date.isoformat(), 'value': value,
+                       'reason': 'Unrecognised status'})
+    
+    valid = statuses.dropna()
+    records = [
+        {'student_id': student_id, 'date': attendance_date, 'status': status}
+        for (_, student_id, attendance_date), status in valid.items()
+    ]
+    return upsert_attendance(records)
+
+def import_attendance_register(stream, filename, chunk_size=1000, progress=None):
+    """Import a wide attendance register into Attendance.
+
+    The first column holds admission numbers and every column whose header is a
+    date holds that day's status codes (P, A, L, H or the full status names);
+    other columns such as names are ignored. Rows are read in chunks, unpivoted
+    with pandas and bulk upserted, one commit per chunk, after which progress is
+    called with the rows done so far. Problems are collected per cell and written
+    to an errors CSV. Returns a summary dict.
+    """
+    rows = iter_upload_values(stream, filename)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError('The register is empty')
+    
+    date_columns = {}
+    for column, value in enumerate(header[1]):
+        if column == 0:
+            continue
+        attendance_date = parse_upload_date(value)
+        if attendance_date:
+            date_columns[column] = attendance_date
+    if not date_columns:
+        raise ValueError('No date columns found in the register header')
+    
+    admission_index = admission_number_index()
+    summary = {'rows': 0, 'dates': len(date_columns), 'inserted': 0, 'updated': 0, 'errors': 0, 'errors_file': None}
+    errors = []
+    chunk = []
+    
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            inserted, updated = _import_register_chunk(chunk, date_columns, admission_index, errors)
+            db.session.commit()
+            summary['rows'] += len(chunk)
+            summary['inserted'] += inserted
+            summary['updated'] += updated
+            chunk = []
+            if progress:
+                progress(summary['rows'])
+    if chunk:
+        inserted, updated = _import_register_chunk(chunk, date_columns, admission_index, errors)
+        db.session.commit()
+        summary['rows'] += len(chunk)
+        summary['inserted'] += inserted
+        summary['updated'] += updated
+    
+    if errors:
+        write_import_errors(summary, ATTENDANCE_IMPORT_FOLDER, 'register_errors', errors)
+    return summary
+
+@import_handler('attendance_register', roles=('teacher', 'admin'), errors_folder=ATTENDANCE_IMPORT_FOLDER)
+def _attendance_register_job(stream, filename, params, progress):
+    return import_attendance_register(stream, filename, progress=progress)
+
+@app.route('/attendance/import', methods=['GET', 'POST'])
 @login_required
-def add_event():
-    if current_user.role != 'admin' and current_user.role != 'teacher':
-        flash('You do not have permission to add events', 'danger')
-        return redirect(url_for('events'))
-        
+def import_attendance():
+    if current_user.role != 'teacher' and current_user.role != 'admin':
+        flash('You do not have permission to import attendance', 'danger')
+        return redirect(url_for('dashboard'))
+    
     if request.method == 'POST':
-        title = request.form.get('title')
-        description = request.form.get('description')
-        date_str = request.form.get('date')
-        time_str = request.form.get('time')
+        file = request.files.get('register_file')
+        if not file or file.filename == '':
+            flash('No selected file', 'danger')
+            return redirect(request.url)
+        
+        if request.form.get('background'):
+            job = queue_import_job('attendance_register', file, created_by=current_user.id)
+            flash('The register has been queued for import', 'success')
+            return redirect(url_for('import_job_status', job_id=job.id))
         
         try:
-            event_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            event_time = datetime.strptime(time_str, '%H:%M').time()
-            
-            new_event = Event(
-                title=title,
-                description=description,
-                date=event_date,
-                time=event_time
-            )
-            
-            db.session.add(new_event)
-            db.session.commit()
-            
-            flash('Event added successfully', 'success')
-            return redirect(url_for('events'))
+            summary = import_attendance_register(file.stream, file.filename)
         except Exception as e:
-            flash(f'Error adding event: {str(e)}', 'danger')
+            db.session.rollback()
+            flash(f'Error importing attendance register: {str(e)}', 'danger')
+            return redirect(request.url)
+        
+        flash(f"Attendance imported ({summary['inserted']} added, {summary['updated']} updated)", 'success')
+        if summary['errors']:
+            flash(f"{summary['errors']} cells could not be imported and were saved for review", 'warning')
+        return render_template('import_attendance.html', summary=summary)
     
-    return render_template('add_event.html')
+    return render_template('import_attendance.html', summary=None)
+
+@app.route('/attendance/import/errors/<path:filename>')
+@login_required
+def attendance_import_errors(filename):
+    if current_user.role != 'teacher' and current_user.role != 'admin':
+        flash('You do not have permission to import attendance', 'danger')
+        return redirect(url_for('dashboard'))
+    return send_from_directory(ATTENDANCE_IMPORT_FOLDER, secure_filename(filename), as_attachment=True)
+
+# Attendance risk
+ATTENDANCE_RISK_WINDOWS = (7, 30, 90)
+RISK_COUNT_FIELDS = ('records', 'absent', 'late')
+
+def _risk_counts(start, end, as_of=None):
+    """Per-student records/absent/late counts between start and end for each window ending at as_of.
+
+    Returns a DataFrame indexed by student_id with columns like absent_30; only
+    rows inside a window's span [as_of - days + 1, as_of] count towards it. With
+    as_of None every row in the range counts towards every window.
+    """
+    columns = [f'{field}_{days}' for days in ATTENDANCE_RISK_WINDOWS for field in RISK_COUNT_FIELDS]
+    if end < start:
+        return pd.DataFrame(columns=columns, dtype='int64')
+    frame = load_attendance_frame(start, end)
+    flags = pd.DataFrame({
+        'records': 1,
+        'absent': (frame['status'] == 'Absent').astype('int64'),
+        'late': (frame['status'] == 'Late Coming').astype('int64')
+    }, index=frame.index)
+    counts = {}
+    for days in ATTENDANCE_RISK_WINDOWS:
+        in_window = flags
+        if as_of is not None:
+            in_window = flags[frame['date'] >= pd.Timestamp(as_of - timedelta(days=days - 1))]
+        summed = in_window.groupby(frame.loc[in_window.index, 'student_id']).sum()
+        for field in RISK_COUNT_FIELDS:
+            counts[f'{field}_{days}'] = summed[field]
+    return pd.DataFrame(counts, columns=columns).fillna(0).astype('int64')
+
+def _risk_score_expression():
+    """SQL for the risk score: 30-day absence rate plus half the 30-day late rate, plus
+    any rise of the 7-day absence rate over the 90-day baseline, in percentage points"""
+    def rate(field, days):
+        records = getattr(StudentAttendanceRisk, f'records_{days}')
+        return db.case((records > 0, 1.0 * getattr(StudentAttendanceRisk, f'{field}_{days}') / records), else_=0.0)
+    deterioration = db.func.max(rate('absent', 7) - rate('absent', 90), 0.0)
+    return 100 * (rate('absent', 30) + 0.5 * rate('late', 30) + deterioration)
+
+def mark_attendance_risk_stale(first_date, last_date):
+    """Note attendance written between first_date and last_date behind the risk checkpoint.
+
+    Incremental refreshes only read days after the checkpoint, so an edit to a day
+    still inside the longest window ending there makes the next refresh rebuild.
+    The caller commits.
+    """
+    checkpoint = get_config_value('attendance_risk_as_of')
+    if checkpoint is None:
+        return
+    checkpoint = date.fromisoformat(checkpoint)
+    if first_date > checkpoint or last_date <= checkpoint - timedelta(days=max(ATTENDANCE_RISK_WINDOWS)):
+        return
+    stale_from = get_config_value('attendance_risk_stale_from')
+    if stale_from is None or first_date < date.fromisoformat(stale_from):
+        set_config_value('attendance_risk_stale_from', first_date.isoformat(),
+                         description='Earliest processed attendance day written since the last risk refresh')
+
+def refresh_attendance_risk(as_of=None, rebuild=False):
+    """Bring StudentAttendanceRisk forward to as_of (default yesterday).
+
+    Only the days that entered or left each rolling window since the last run are
+    read and applied as increments; a full rebuild happens on the first run, when
+    the gap exceeds the longest window, when rebuild is set, or when attendance
+    for days already processed was written since (see mark_attendance_risk_stale).
+    Returns the number of students whose counts changed, or None when already up
+    to date.
+    """
+    as_of = as_of or datetime.now().date() - timedelta(days=1)
+    previous = get_config_value('attendance_risk_as_of')
+    last = date.fromisoformat(previous) if previous else None
+    stale_from = get_config_value('attendance_risk_stale_from')
+    if stale_from is not None and last is not None:
+        # Rebuild the processed windows without moving the checkpoint backwards
+        rebuild = True
+        as_of = max(as_of, last)
+    if last is not None and last >= as_of and not rebuild:
+        return None
+    
+    if rebuild or last is None or (as_of - last).days >= max(ATTENDANCE_RISK_WINDOWS):
+        db.session.execute(db.delete(StudentAttendanceRisk))
+        deltas = _risk_counts(as_of - timedelta(days=max(ATTENDANCE_RISK_WINDOWS) - 1), as_of, as_of)
+    else:
+        deltas = _risk_counts(last + timedelta(days=1), as_of, as_of)
+        for days in ATTENDANCE_RISK_WINDOWS:
+            # Days that were in the window ending at last but are not in the one ending at as_of
+            leaving = _risk_counts(last - timedelta(days=days - 1), min(last, as_of - timedelta(days=days)))
+            window_columns = [f'{field}_{days}' for field in RISK_COUNT_FIELDS]
+            deltas = deltas.sub(leaving[window_columns], fill_value=0).fillna(0)
+        deltas = deltas.astype('int64')
+    
+    rows = [dict(student_id=int(student_id), updated_at=datetime.now(),
+                 **{column: int(value) for column, value in values.items()})
+            for student_id, values in deltas.to_dict('index').items() if any(values.values())]
+    if rows:
+        stmt = sqlite_insert(StudentAttendanceRisk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StudentAttendanceRisk.student_id],
+            set_={
+                column: getattr(StudentAttendanceRisk, column) + getattr(stmt.excluded, column)
+                for column in deltas.columns
+            } | {'updated_at': stmt.excluded.updated_at}
+        )
+        db.session.execute(stmt, rows)
+    db.session.execute(db.update(StudentAttendanceRisk).values(risk_score=_risk_score_expression()))
+    
+    # Move the checkpoint only if no other run moved it first, so increments never apply twice
+    if previous is None:
+        set_config_value('attendance_risk_as_of', as_of.isoformat(),
+                         description='Last day processed into StudentAttendanceRisk')
+    else:
+        moved = db.session.execute(db.update(SystemConfig).where(
+            SystemConfig.config_key == 'attendance_risk_as_of',
+            SystemConfig.config_value == json.dumps(previous)
+        ).values(config_value=json.dumps(as_of.isoformat()), updated_at=datetime.now()))
+        if moved.rowcount != 1:
+            db.session.rollback()
+            return None
+    if stale_from is not None:
+        # Clear the marker unless a later write moved it while this run was reading
+        db.session.execute(db.delete(SystemConfig).where(
+            SystemConfig.config_key == 'attendance_risk_stale_from',
+            SystemConfig.config_value == json.dumps(stale_from)
+        ))
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command('refresh-attendance-risk')
+@click.option('--as-of', default=None, help='Last day to include (YYYY-MM-DD); defaults to yesterday')
+@click.option('--rebuild', is_flag=True, help='Recompute every window from scratch')
+def refresh_attendance_risk_command(as_of, rebuild):
+    """Update rolling absence and lateness rates for the at-risk list."""
+    as_of = datetime.strptime(as_of, '%Y-%m-%d').date() if as_of else None
+    changed = refresh_attendance_risk(as_of, rebuild)
+    if changed is None:
+        click.echo('Attendance risk is already up to date')
+    else:
+        click.echo(f'Updated attendance risk for {changed} students')
+
+def refresh_attendance_risk_periodically():
+    """Background thread that keeps the attendance risk table current"""
+    with app.app_context():
+        while True:
+            try:
+                refresh_attendance_risk()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error refreshing attendance risk: {str(e)}")
+            
+            # Check every hour
+            time.sleep(3600)
+
+@app.route('/attendance/at_risk')
+@login_required
+def attendance_at_risk():
+    if current_user.role != 'teacher' and current_user.role != 'admin':
+        flash('You do not have permission to view this page', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    class_name = request.args.get('class_name') or None
+    min_score = request.args.get('min_score', 0, type=float)
+    
+    query = db.session.query(StudentAttendanceRisk, Student, User).join(
+        Student, StudentAttendanceRisk.student_id == Student.id
+    ).join(User, Student.user_id == User.id).filter(StudentAttendanceRisk.risk_score > min_score)
+    if class_name:
+        query = query.filter(Student.class_name == class_name)
+    page = keyset_page(
+        query,
+        [(StudentAttendanceRisk.risk_score, True), (StudentAttendanceRisk.student_id, False)],
+        key=lambda row: (row[0].risk_score, row[0].student_id),
+        cursor=request.args.get('cursor'),
+        per_page=get_per_page()
+    )
+    
+    def rate(risk, field, days):
+        records = getattr(risk, f'records_{days}')
+        return getattr(risk, f'{field}_{days}') / records * 100 if records else 0
+    
+    students_data = [{
+        'student_id': student.id,
+        'name': f"{user.first_name} {user.last_name}",
+        'admission_number': student.admission_number,
+        'class_name': student.class_name,
+        'section': student.section,
+        'risk_score': round(risk.risk_score, 1),
+        'rates': {days: {'absent': rate(risk, 'absent', days), 'late': rate(risk, 'late', days)}
+                  for days in ATTENDANCE_RISK_WINDOWS}
+    } for risk, student, user in page.items]
+    
+    return render_template('attendance_at_risk.html',
+                           students=students_data,
+                           next_cursor=page.next_cursor,
+                           as_of=get_config_value('attendance_risk_as_of'),
+                           class_name=class_name,
+                           min_score=min_score)
 
 @app.route('/attendance')
 @login_required
 def attendance():
     if current_user.role == 'student':
         student = Student.query.filter_by(user_id=current_user.id).first()
-        attendances = Attendance.query.filter_by(student_id=student.id).order_by(Attendance.date.desc()).all()
+        attendances = student_attendance_history(student.id)
         return render_template('attendance.html', attendances=attendances, student=student)
     
     elif current_user.role == 'teacher' or current_user.role == 'admin':
-        students = Student.query.all()
-        return render_template('manage_attendance.html', students=students)
+        return render_template('manage_attendance.html', **student_picker_context(default_per_page=100))
     
     else:
         flash('You do not have permission to view this page', 'danger')
@@ -1883,32 +4372,20 @@ def mark_attendance():
         date_str = request.form.get('date')
         attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
-        for key, value in request.form.items():
-            if key.startswith('status_'):
-                student_id = int(key.replace('status_', ''))
-                
-                # Check if attendance record already exists
-                existing = Attendance.query.filter_by(
-                    student_id=student_id,
-                    date=attendance_date
-                ).first()
-                
-                if existing:
-                    existing.status = value
-                else:
-                    new_attendance = Attendance(
-                        student_id=student_id,
-                        date=attendance_date,
-                        status=value
-                    )
-                    db.session.add(new_attendance)
+        records = [{
+            'student_id': int(key.replace('status_', '')),
+            'date': attendance_date,
+            'status': value
+        } for key, value in request.form.items() if key.startswith('status_')]
         
+        inserted, updated = upsert_attendance(records)
         db.session.commit()
-        flash('Attendance marked successfully', 'success')
+        flash(f'Attendance marked successfully ({inserted} added, {updated} updated)', 'success')
         return redirect(url_for('attendance'))
     
-    students = Student.query.all()
-    return render_template('mark_attendance.html', students=students, today=datetime.now().date())
+    # Registers are marked a class at a time, so default to a larger page
+    return render_template('mark_attendance.html', today=datetime.now().date(),
+                           **student_picker_context(default_per_page=100))
 
 @app.route('/exams')
 @login_required
@@ -1949,25 +4426,244 @@ def add_exam():
     
     return render_template('add_exam.html')
 
-@app.route('/exam_results/<int:exam_id>')
-@login_required
-def exam_results(exam_id):
-    exam = Exam.query.get_or_404(exam_id)
-    results = ExamResult.query.filter_by(exam_id=exam_id).all()
+# Grading scales
+# The A+ to F ladder used until a scale is configured; each band is (grade, minimum mark)
+DEFAULT_GRADING_BANDS = [('A+', 97), ('A', 93), ('A-', 90), ('B+', 87), ('B', 83), ('B-', 80),
+                         ('C+', 77), ('C', 73), ('C-', 70), ('D+', 67), ('D', 60), ('F', 0)]
+DEFAULT_GRADING_SCALE = 'default'
+BOW_GRADING_SCALE = 'BOW Corporation'
+
+GradingScale = namedtuple('GradingScale', ['name', 'version', 'thresholds', 'bounds', 'grades'])
+
+# Compiled scales for the current 'grading_scales' data version
+_grading_scales = {'version': None, 'scales': {}}
+
+def compile_grading_scale(name, version, bands):
+    """Sort (grade, minimum) bands into ascending threshold arrays for binary search"""
+    ordered = sorted(((float(minimum), grade) for grade, minimum in bands))
+    thresholds = np.array([minimum for minimum, _ in ordered])
+    return GradingScale(name, version, thresholds, tuple(thresholds.tolist()),
+                        np.array([grade for _, grade in ordered], dtype=object))
+
+def get_grading_scale(name=None):
+    """The compiled scale for an exam type, falling back to the default scale.
+
+    Scales are recompiled only when the grading_scales data version changes.
+    """
+    version = get_data_version('grading_scales')
+    if _grading_scales['version'] != version:
+        scales = {DEFAULT_GRADING_SCALE: compile_grading_scale(DEFAULT_GRADING_SCALE, 0, DEFAULT_GRADING_BANDS)}
+        for scale_name, versions in get_config_value('grading_scales', {}).items():
+            current = versions[-1]
+            scales[scale_name] = compile_grading_scale(
+                scale_name, current['version'], [(band['grade'], band['min']) for band in current['bands']]
+            )
+        _grading_scales['scales'] = scales
+        _grading_scales['version'] = version
+    scales = _grading_scales['scales']
+    return scales.get(name) or scales[DEFAULT_GRADING_SCALE]
+
+def grade_for(scale, marks):
+    """Grade for a single mark, or None when marks is missing"""
+    if marks is None:
+        return None
+    return scale.grades[max(bisect.bisect_right(scale.bounds, float(marks)) - 1, 0)]
+
+def grades_for(scale, marks):
+    """Grades for a whole column of marks; missing marks get None"""
+    marks = np.asarray(marks, dtype=float)
+    grades = scale.grades[np.maximum(np.searchsorted(scale.thresholds, marks, side='right') - 1, 0)]
+    grades[np.isnan(marks)] = None
+    return grades
+
+def save_grading_scale(name, bands, updated_by=None):
+    """Validate bands and store them as the next version of a scale; the caller commits.
+
+    bands is a list of {'grade', 'min'} dicts. Grades and minimums must be unique
+    and the lowest band must start at 0 so every mark gets a grade.
+    """
+    cleaned = []
+    for band in bands:
+        grade = str(band.get('grade') or '').strip()
+        if not grade or len(grade) > 5:
+            raise ValueError('Each band needs a grade of at most 5 characters')
+        cleaned.append({'grade': grade, 'min': float(band['min'])})
+    if not cleaned:
+        raise ValueError('A grading scale needs at least one band')
+    if len({band['grade'] for band in cleaned}) != len(cleaned) or len({band['min'] for band in cleaned}) != len(cleaned):
+        raise ValueError('Grades and minimum marks must be unique')
+    if min(band['min'] for band in cleaned) != 0:
+        raise ValueError('The lowest band must start at 0')
+    
+    scales = get_config_value('grading_scales', {})
+    versions = scales.setdefault(name, [])
+    version = versions[-1]['version'] + 1 if versions else 1
+    versions.append({
+        'version': version,
+        'bands': sorted(cleaned, key=lambda band: band['min'], reverse=True),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'created_by': updated_by
+    })
+    set_config_value('grading_scales', scales, description='Versioned grading scales per exam type',
+                     updated_by=updated_by)
+    bump_data_version('grading_scales')
+    return version
+
+def regrade_results(exam_type=None, chunk_size=1000):
+    """Re-apply the current scales to stored marks, writing only grades that change.
+
+    BOW results are always regraded with the BOW scale. ExamResult grades can be
+    entered by hand, so they are regraded only for an explicitly named exam type.
+    Returns {table: rows changed}.
+    """
+    changed = {}
+    targets = []
+    if exam_type is None or exam_type == BOW_GRADING_SCALE:
+        targets.append((BOWCorporationResult, BOWCorporationResult.marks, get_grading_scale(BOW_GRADING_SCALE), None))
+    if exam_type is not None and exam_type != BOW_GRADING_SCALE:
+        exam_ids = db.select(Exam.id).where(Exam.exam_type == exam_type)
+        targets.append((ExamResult, ExamResult.percentage, get_grading_scale(exam_type),
+                        ExamResult.exam_id.in_(exam_ids)))
+    
+    for model, marks_column, scale, condition in targets:
+        query = db.session.query(model.id, model.student_id, marks_column, model.grade)
+        if condition is not None:
+            query = query.filter(condition)
+        rows = query.all()
+        if not rows:
+            changed[model.__tablename__] = 0
+            continue
+        ids, student_ids, marks, grades = zip(*rows)
+        new_grades = grades_for(scale, [np.nan if value is None else value for value in marks])
+        updates = [{'row_id': row_id, 'new_grade': new_grade}
+                   for row_id, old_grade, new_grade in zip(ids, grades, new_grades)
+                   if new_grade is not None and new_grade != old_grade]
+        table = model.__table__
+        stmt = table.update().where(table.c.id == db.bindparam('row_id')).values(grade=db.bindparam('new_grade'))
+        for start in range(0, len(updates), chunk_size):
+            db.session.execute(stmt, updates[start:start + chunk_size])
+        updated_ids = {update['row_id'] for update in updates}
+        invalidate_student_profiles({student_id for row_id, student_id in zip(ids, student_ids) if row_id in updated_ids})
+        if model is ExamResult and updates:
+            invalidate_exam_statistics(db.session.scalars(exam_ids))
+        changed[model.__tablename__] = len(updates)
+    db.session.commit()
+    return changed
+
+@app.cli.command('regrade-results')
+@click.option('--exam-type', default=None,
+              help=f'Exam type whose ExamResult grades to recompute; defaults to {BOW_GRADING_SCALE} results only')
+def regrade_results_command(exam_type):
+    """Recompute stored grades after a grading scale change."""
+    for table, count in regrade_results(exam_type).items():
+        click.echo(f'{table}: {count} grades changed')
+
+# Exam statistics
+EXAM_HISTOGRAM_BINS = np.arange(0, 101, 10)
+EXAM_PERCENTILES = (10, 25, 75, 90)
+
+exam_stats_cache = TTLCache(ttl=3600)
+
+def compute_exam_statistics(student_ids, percentages):
+    """Summary statistics, a 10-point histogram and each student's rank and percentile.
+
+    Rank is competition style (ties share the best rank) and percentile is the
+    share of scores at or below the student's. Students without a percentage are
+    left out.
+    """
+    scores = np.asarray(percentages, dtype=float)
+    ids = np.asarray(student_ids)
+    mask = np.isfinite(scores)
+    scores, ids = scores[mask], ids[mask]
+    if len(scores) == 0:
+        return {'count': 0, 'histogram': [], 'ranks': {}}
+    
+    ordered = np.sort(scores)
+    ranks = len(ordered) - np.searchsorted(ordered, scores, side='right') + 1
+    percentiles = np.searchsorted(ordered, scores, side='right') / len(ordered) * 100
+    counts, edges = np.histogram(np.clip(scores, 0, 100), bins=EXAM_HISTOGRAM_BINS)
+    return {
+        'count': int(len(scores)),
+        'mean': float(scores.mean()),
+        'median': float(np.median(scores)),
+        'std': float(scores.std()),
+        'min': float(ordered[0]),
+        'max': float(ordered[-1]),
+        'percentiles': {p: float(value) for p, value in zip(EXAM_PERCENTILES, np.percentile(scores, EXAM_PERCENTILES))},
+        'histogram': [{'from': int(low), 'to': int(high), 'count': int(count)}
+                      for low, high, count in zip(edges[:-1], edges[1:], counts)],
+        'ranks': {int(student_id): {'rank': int(rank), 'percentile': float(percentile)}
+                  for student_id, rank, percentile in zip(ids, ranks, percentiles)}
+    }
+
+def invalidate_exam_statistics(exam_ids=None):
+    """Drop cached results for these exams, or for every exam when None, once the current transaction commits"""
+    stale = db.session.info.setdefault('stale_exam_statistics', set())
+    stale.update([None] if exam_ids is None else (int(exam_id) for exam_id in exam_ids))
+
+@db.event.listens_for(db.session, 'after_commit')
+def _drop_stale_exam_statistics(db_session):
+    stale = db_session.info.pop('stale_exam_statistics', None)
+    if stale and None in stale:
+        exam_stats_cache.invalidate()
+    elif stale:
+        exam_stats_cache.invalidate_if(lambda key: key in stale)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_stale_exam_statistics(db_session):
+    db_session.info.pop('stale_exam_statistics', None)
+
+@db.event.listens_for(ExamResult, 'after_insert')
+@db.event.listens_for(ExamResult, 'after_update')
+@db.event.listens_for(ExamResult, 'after_delete')
+def _exam_result_row_changed(mapper, connection, target):
+    invalidate_exam_statistics([target.exam_id])
+
+# Cached rows carry student names, so renames and deletions drop every exam
+@db.event.listens_for(Student, 'after_update')
+@db.event.listens_for(Student, 'after_delete')
+@db.event.listens_for(User, 'after_update')
+def _exam_result_student_changed(mapper, connection, target):
+    invalidate_exam_statistics()
+
+def build_exam_results(exam_id):
+    """An exam's result rows with names, rank and percentile, plus its statistics, from one joined query"""
+    rows = db.session.query(
+        ExamResult.student_id, ExamResult.grade, ExamResult.percentage,
+        Student.admission_number, User.first_name, User.last_name
+    ).join(Student, ExamResult.student_id == Student.id).outerjoin(
+        User, Student.user_id == User.id
+    ).filter(ExamResult.exam_id == exam_id).order_by(ExamResult.id).all()
+    
+    statistics = compute_exam_statistics(
+        [row.student_id for row in rows],
+        [row.percentage if row.percentage is not None else np.nan for row in rows]
+    )
     
     students_data = []
-    for result in results:
-        student = Student.query.get(result.student_id)
-        user = User.query.get(student.user_id)
+    for row in rows:
+        standing = statistics['ranks'].get(row.student_id, {})
         students_data.append({
-            'id': student.id,
-            'name': f"{user.first_name} {user.last_name}",
-            'admission_number': student.admission_number,
-            'grade': result.grade,
-            'percentage': result.percentage
+            'id': row.student_id,
+            'name': f"{row.first_name} {row.last_name}",
+            'admission_number': row.admission_number,
+            'grade': row.grade,
+            'percentage': row.percentage,
+            'rank': standing.get('rank'),
+            'percentile': standing.get('percentile')
         })
-    
-    return render_template('exam_results.html', exam=exam, results=students_data)
+    return students_data, statistics
+
+def get_exam_results(exam_id):
+    """Cached build_exam_results, dropped whenever the exam's results or its students change"""
+    return exam_stats_cache.get_or_compute(exam_id, lambda: build_exam_results(exam_id))
+
+@app.route('/exam_results/<int:exam_id>')
+@login_required
+def exam_results(exam_id):
+    exam = Exam.query.get_or_404(exam_id)
+    students_data, statistics = get_exam_results(exam_id)
+    return render_template('exam_results.html', exam=exam, results=students_data, statistics=statistics)
 
 @app.route('/final-exams')
 @login_required
@@ -2095,10 +4791,9 @@ def add_final_result(final_exam_id):
         except Exception as e:
             flash(f'Error adding result: {str(e)}', 'danger')
     
-    students = Student.query.all()
     return render_template('add_final_result.html', 
                           final_exam=final_exam, 
-                          students=students)
+                          **student_picker_context())
 
 @app.route('/publish-final-exam/<int:final_exam_id>', methods=['POST'])
 @login_required
@@ -2228,6 +4923,7 @@ def add_bow_results(final_exam_id):
         results_to_add = []
         
         # Process form data for multiple subjects
+        scale = get_grading_scale(BOW_GRADING_SCALE)
         index = 0
         while f'subject_code_{index}' in request.form:
             subject_code = request.form.get(f'subject_code_{index}')
@@ -2236,19 +4932,8 @@ def add_bow_results(final_exam_id):
             marks = request.form.get(f'marks_{index}')
             
             # Calculate grade based on marks
-            grade = 'F'
             marks_float = float(marks)
-            if marks_float >= 97: grade = 'A+'
-            elif marks_float >= 93: grade = 'A'
-            elif marks_float >= 90: grade = 'A-'
-            elif marks_float >= 87: grade = 'B+'
-            elif marks_float >= 83: grade = 'B'
-            elif marks_float >= 80: grade = 'B-'
-            elif marks_float >= 77: grade = 'C+'
-            elif marks_float >= 73: grade = 'C'
-            elif marks_float >= 70: grade = 'C-'
-            elif marks_float >= 67: grade = 'D+'
-            elif marks_float >= 60: grade = 'D'
+            grade = grade_for(scale, marks_float)
             
             if subject_code and subject_name and credit_hours and marks:
                 subject_count += 1
@@ -2300,10 +4985,148 @@ def add_bow_results(final_exam_id):
             db.session.rollback()
             flash(f'Error adding results: {str(e)}', 'danger')
     
-    students = Student.query.all()
     return render_template('add_bow_results.html', 
                           final_exam=final_exam, 
-                          students=students)
+                          **student_picker_context())
+
+# BOW results import
+BOW_IMPORT_FOLDER = os.path.join(app.instance_path, 'bow_imports')
+BOW_IMPORT_COLUMNS = ['admission_number', 'subject_code', 'subject_name', 'credit_hours', 'marks']
+BOW_MIN_COURSES = 4
+BOW_MAX_COURSES = 9
+BOW_PROGRESS_ROWS = 10000
+
+def read_bow_results_sheet(stream, filename, progress=None):
+    """Stream a BOW results sheet into a DataFrame of the import columns plus row_number.
+
+    Rows are read one at a time with iter_upload_values and only the needed
+    cells are kept, so the workbook itself is never loaded into memory.
+    progress is called every BOW_PROGRESS_ROWS rows.
+    """
+    rows = iter_upload_values(stream, filename)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError('The results sheet is empty')
+    headers = [normalize_header(value) for value in header[1]]
+    missing_columns = [column for column in BOW_IMPORT_COLUMNS if column not in headers]
+    if missing_columns:
+        raise ValueError(f'Missing columns in Excel file: {", ".join(missing_columns)}')
+    
+    positions = [headers.index(column) for column in BOW_IMPORT_COLUMNS]
+    columns = {column: [] for column in ['row_number'] + BOW_IMPORT_COLUMNS}
+    for row_number, values in rows:
+        columns['row_number'].append(row_number)
+        for column, position in zip(BOW_IMPORT_COLUMNS, positions):
+            columns[column].append(values[position] if position < len(values) else None)
+        if progress and len(columns['row_number']) % BOW_PROGRESS_ROWS == 0:
+            progress(len(columns['row_number']))
+    if not columns['row_number']:
+        raise ValueError('The results sheet has no data rows')
+    return pd.DataFrame(columns)
+
+def validate_bow_results(frame, admission_index, scale):
+    """Validate and grade a results frame column-wise, returning (frame, errors).
+
+    Adds student_id, credit_hours, marks and grade columns plus a valid flag.
+    A student's rows are only valid when every one of them is and the student
+    has between BOW_MIN_COURSES and BOW_MAX_COURSES courses; otherwise none of
+    their results are replaced. Each error is a dict with row_number, column,
+    value and reason.
+    """
+    text = {
+        column: frame[column].map(_clean_cell)
+        for column in ('admission_number', 'subject_code', 'subject_name', 'credit_hours', 'marks')
+    }
+    frame = frame.assign(
+        admission_number=text['admission_number'],
+        subject_code=text['subject_code'],
+        subject_name=text['subject_name'],
+        student_id=text['admission_number'].str.upper().map(admission_index),
+        credit_hours=pd.to_numeric(text['credit_hours'], errors='coerce'),
+        marks=pd.to_numeric(text['marks'], errors='coerce')
+    )
+    
+    checks = [
+        (frame['student_id'].isna(), 'admission_number', 'Student not found'),
+        (frame['subject_code'] == '', 'subject_code', 'Required value missing'),
+        (frame['subject_name'] == '', 'subject_name', 'Required value missing'),
+        (~((frame['credit_hours'] > 0) & (frame['credit_hours'] % 1 == 0)), 'credit_hours',
+         'Credit hours must be a positive whole number'),
+        (~frame['marks'].between(0, 100), 'marks', 'Marks must be a number between 0 and 100')
+    ]
+    errors = []
+    row_ok = pd.Series(True, index=frame.index)
+    for failed, column, reason in checks:
+        row_ok &= ~failed
+        errors.extend({'row_number': row_number, 'column': column, 'value': value, 'reason': reason}
+                      for row_number, value in zip(frame.loc[failed, 'row_number'], text[column][failed]))
+    
+    known = frame['student_id'].notna()
+    by_student = frame.loc[known].groupby('student_id')
+    course_counts = by_student['row_number'].transform('size')
+    counted = frame.loc[known].assign(course_count=course_counts)
+    first_rows = counted.drop_duplicates('student_id')
+    wrong_count = first_rows[(first_rows['course_count'] < BOW_MIN_COURSES) | (first_rows['course_count'] > BOW_MAX_COURSES)]
+    errors.extend({
+        'row_number': row_number, 'column': 'admission_number', 'value': admission_number,
+        'reason': f'Student has {count} courses; between {BOW_MIN_COURSES} and {BOW_MAX_COURSES} are required'
+    } for row_number, admission_number, count in zip(
+        wrong_count['row_number'], wrong_count['admission_number'], wrong_count['course_count']))
+    
+    student_ok = row_ok[known].groupby(frame.loc[known, 'student_id']).all()
+    student_ok &= by_student.size().between(BOW_MIN_COURSES, BOW_MAX_COURSES)
+    valid = frame['student_id'].map(student_ok).fillna(False).astype(bool)
+    frame = frame.assign(valid=valid, grade=grades_for(scale, frame['marks']))
+    errors.sort(key=lambda error: error['row_number'])
+    return frame, errors
+
+def import_bow_result_sheet(final_exam_id, stream, filename, chunk_size=5000, progress=None):
+    """Replace BOW results for the students in an uploaded sheet.
+
+    Admission numbers are resolved from one prefetched map, existing results
+    for the imported students are removed with chunked set-based deletes and
+    the new rows are bulk inserted in chunks, all in one transaction. progress
+    sees rows read while the sheet streams and the full total only once the
+    writes have committed. Returns a summary dict and writes rejected rows to
+    an errors CSV.
+    """
+    frame = read_bow_results_sheet(stream, filename, progress)
+    admission_index = admission_number_index()
+    frame, errors = validate_bow_results(frame, admission_index, get_grading_scale(BOW_GRADING_SCALE))
+    
+    imported = frame[frame['valid']]
+    student_ids = sorted(int(student_id) for student_id in imported['student_id'].unique())
+    known_ids = frame.loc[frame['student_id'].notna(), 'student_id'].nunique()
+    summary = {'rows': len(frame), 'students': len(student_ids), 'results': len(imported),
+               'skipped_students': known_ids - len(student_ids), 'errors': 0, 'errors_file': None}
+    
+    for start in range(0, len(student_ids), chunk_size):
+        db.session.execute(db.delete(BOWCorporationResult).where(
+            BOWCorporationResult.exam_id == final_exam_id,
+            BOWCorporationResult.student_id.in_(student_ids[start:start + chunk_size])
+        ))
+    records = pd.DataFrame({
+        'student_id': imported['student_id'].astype('int64'),
+        'exam_id': final_exam_id,
+        'subject_code': imported['subject_code'],
+        'subject_name': imported['subject_name'],
+        'credit_hours': imported['credit_hours'].astype('int64'),
+        'marks': imported['marks'].astype(float),
+        'grade': imported['grade']
+    }).to_dict('records')
+    for start in range(0, len(records), chunk_size):
+        db.session.bulk_insert_mappings(BOWCorporationResult, records[start:start + chunk_size])
+    db.session.commit()
+    if progress:
+        progress(len(frame), len(frame))
+    
+    if errors:
+        write_import_errors(summary, BOW_IMPORT_FOLDER, f'bow_errors_{final_exam_id}', errors)
+    return summary
+
+@import_handler('bow_results', roles=('admin',), errors_folder=BOW_IMPORT_FOLDER)
+def _bow_results_job(stream, filename, params, progress):
+    return import_bow_result_sheet(params['final_exam_id'], stream, filename, progress=progress)
 
 @app.route('/import-bow-results/<int:final_exam_id>', methods=['GET', 'POST'])
 @login_required
@@ -2326,96 +5149,63 @@ def import_bow_results(final_exam_id):
             return redirect(request.url)
             
         if file:
+            if request.form.get('background'):
+                job = queue_import_job('bow_results', file, {'final_exam_id': final_exam_id}, created_by=current_user.id)
+                flash('The results file has been queued for import', 'success')
+                return redirect(url_for('import_job_status', job_id=job.id))
+            
             try:
-                # Read Excel file
-                df = pd.read_excel(file)
-                
-                # Validate Excel structure
-                required_columns = ['admission_number', 'subject_code', 'subject_name', 'credit_hours', 'marks']
-                missing_columns = [col for col in required_columns if col not in df.columns]
-                
-                if missing_columns:
-                    flash(f'Missing columns in Excel file: {", ".join(missing_columns)}', 'danger')
-                    return redirect(request.url)
-                
-                # Process data
-                results_added = 0
-                errors = []
-                
-                # Group by admission number
-                student_groups = df.groupby('admission_number')
-                
-                for admission_number, group in student_groups:
-                    # Find student
-                    student = Student.query.filter_by(admission_number=admission_number).first()
-                    if not student:
-                        errors.append(f'Student with admission number {admission_number} not found')
-                        continue
-                    
-                    # Validate course count (4-9)
-                    course_count = len(group)
-                    if course_count < 4:
-                        errors.append(f'Student {admission_number} has less than 4 courses ({course_count})')
-                        continue
-                        
-                    if course_count > 9:
-                        errors.append(f'Student {admission_number} has more than 9 courses ({course_count})')
-                        continue
-                    
-                    # Delete existing results for this student
-                    BOWCorporationResult.query.filter_by(
-                        student_id=student.id,
-                        exam_id=final_exam_id
-                    ).delete()
-                    
-                    # Add new results
-                    for _, row in group.iterrows():
-                        marks = float(row['marks'])
-                        
-                        # Calculate grade based on marks
-                        grade = 'F'
-                        if marks >= 97: grade = 'A+'
-                        elif marks >= 93: grade = 'A'
-                        elif marks >= 90: grade = 'A-'
-                        elif marks >= 87: grade = 'B+'
-                        elif marks >= 83: grade = 'B'
-                        elif marks >= 80: grade = 'B-'
-                        elif marks >= 77: grade = 'C+'
-                        elif marks >= 73: grade = 'C'
-                        elif marks >= 70: grade = 'C-'
-                        elif marks >= 67: grade = 'D+'
-                        elif marks >= 60: grade = 'D'
-                        
-                        new_result = BOWCorporationResult(
-                            student_id=student.id,
-                            exam_id=final_exam_id,
-                            subject_code=row['subject_code'],
-                            subject_name=row['subject_name'],
-                            credit_hours=int(row['credit_hours']),
-                            marks=marks,
-                            grade=grade
-                        )
-                        db.session.add(new_result)
-                    
-                    results_added += 1
-                
-                if results_added > 0:
-                    db.session.commit()
-                    flash(f'Successfully imported results for {results_added} students', 'success')
-                
-                if errors:
-                    error_message = '<br>'.join(errors)
-                    flash(f'There were some errors during import:<br>{error_message}', 'warning')
-                
-                return redirect(url_for('bow_corporation_results', final_exam_id=final_exam_id))
-                
+                summary = import_bow_result_sheet(final_exam_id, file.stream, file.filename)
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error importing from Excel: {str(e)}', 'danger')
                 return redirect(request.url)
+            
+            if summary['students'] > 0:
+                flash(f"Successfully imported {summary['results']} results for {summary['students']} students", 'success')
+            
+            if summary['errors']:
+                errors_url = url_for('bow_import_errors', filename=summary['errors_file'])
+                flash(f"{summary['errors']} problems were found and {summary['skipped_students']} students were skipped. "
+                      f"<a href=\"{errors_url}\">Download the error report</a>", 'warning')
+            
+            return redirect(url_for('bow_corporation_results', final_exam_id=final_exam_id))
     
     return render_template('import_bow_results.html', final_exam=final_exam)
 
+@app.route('/import-bow-results/errors/<path:filename>')
+@login_required
+def bow_import_errors(filename):
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page', 'danger')
+        return redirect(url_for('dashboard'))
+    return send_from_directory(BOW_IMPORT_FOLDER, secure_filename(filename), as_attachment=True)
+
+def upsert_exam_results(exam_id, results):
+    """Insert or update an exam's results keyed on (exam_id, student_id) in one statement.
+
+    results maps student_id to a dict with grade and percentage. Existing results
+    for the exam are prefetched with one query to count inserts and updates.
+    Returns (inserted, updated) and leaves the commit to the caller.
+    """
+    if not results:
+        return 0, 0
+    existing = {student_id for (student_id,) in db.session.query(ExamResult.student_id).filter_by(exam_id=exam_id)}
+    
+    stmt = sqlite_insert(ExamResult)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ExamResult.exam_id, ExamResult.student_id],
+        set_={'grade': stmt.excluded.grade, 'percentage': stmt.excluded.percentage}
+    )
+    db.session.execute(stmt, [
+        {'exam_id': exam_id, 'student_id': student_id, 'grade': result['grade'], 'percentage': result['percentage']}
+        for student_id, result in results.items()
+    ])
+    invalidate_student_profiles(results)
+    invalidate_exam_statistics([exam_id])
+    updated = len(existing.intersection(results))
+    return len(results) - updated, updated
+
 @app.route('/add_result/<int:exam_id>', methods=['GET', 'POST'])
 @login_required
 def add_result(exam_id):
@@ -2426,41 +5216,35 @@ def add_result(exam_id):
     exam = Exam.query.get_or_404(exam_id)
     
     if request.method == 'POST':
-        for key, value in request.form.items():
-            if key.startswith('grade_'):
-                student_id = int(key.replace('grade_', ''))
-                grade = value
-                percentage = request.form.get(f'percentage_{student_id}')
-                
-                # Check if result already exists
-                existing = ExamResult.query.filter_by(
-                    exam_id=exam_id,
-                    student_id=student_id
-                ).first()
-                
-                try:
-                    percentage_float = float(percentage)
-                    if existing:
-                        existing.grade = grade
-                        existing.percentage = percentage_float
-                    else:
-                        new_result = ExamResult(
-                            exam_id=exam_id,
-                            student_id=student_id,
-                            grade=grade,
-                            percentage=percentage_float
-                        )
-                        db.session.add(new_result)
-                except ValueError:
-                    flash(f'Invalid percentage value for student ID {student_id}', 'danger')
-                    return redirect(url_for('add_result', exam_id=exam_id))
-        
+        # Validate every row before writing anything; blank grades come from the exam type's scale
+        scale = get_grading_scale(exam.exam_type)
+        results = {}
+        invalid = []
+        for key, grade in request.form.items():
+            if not key.startswith('grade_'):
+                continue
+            student_key = key.replace('grade_', '')
+            try:
+                student_id = int(student_key)
+                percentage = float(request.form.get(f'percentage_{student_key}'))
+            except (TypeError, ValueError):
+                invalid.append(student_key)
+                continue
+            if not 0 <= percentage <= 100:
+                invalid.append(student_key)
+                continue
+            results[student_id] = {'grade': grade.strip() or grade_for(scale, percentage), 'percentage': percentage}
+        
+        if invalid:
+            flash(f"Invalid percentage value for student ID {', '.join(invalid)}; no results were saved", 'danger')
+            return redirect(url_for('add_result', exam_id=exam_id))
+        
+        inserted, updated = upsert_exam_results(exam_id, results)
         db.session.commit()
-        flash('Exam results added successfully', 'success')
+        flash(f'Exam results added successfully ({inserted} added, {updated} updated)', 'success')
         return redirect(url_for('exam_results', exam_id=exam_id))
     
-    students = Student.query.all()
-    return render_template('add_result.html', exam=exam, students=students)
+    return render_template('add_result.html', exam=exam, **student_picker_context(default_per_page=100))
 
 @app.route('/profile')
 @login_required
@@ -2668,6 +5452,19 @@ def search():
     return render_template('search_results.html', results=results, query=query)
 
 # Admin, ICT and Accounts Routes
+def delete_student_records(student):
+    """Delete a student and every row keyed on them; the caller deletes the user and commits"""
+    Attendance.query.filter_by(student_id=student.id).delete()
+    AttendanceArchive.query.filter_by(student_id=student.id).delete()
+    bump_data_version('attendance')
+    ExamResult.query.filter_by(student_id=student.id).delete()
+    CourseEnrollment.query.filter_by(student_id=student.id).delete()
+    CourseAttendance.query.filter_by(student_id=student.id).delete()
+    CourseAttendanceSummary.query.filter_by(student_id=student.id).delete()
+    StudentBalance.query.filter_by(student_id=student.id).delete()
+    StudentAttendanceRisk.query.filter_by(student_id=student.id).delete()
+    db.session.delete(student)
+
 @app.route('/admin/users', methods=['GET', 'POST'])
 @login_required
 def admin_users():
@@ -2742,12 +5539,7 @@ def admin_users():
             # Check if user is a student and delete related records
             student = Student.query.filter_by(user_id=user.id).first()
             if student:
-                # Delete attendance records
-                Attendance.query.filter_by(student_id=student.id).delete()
-                # Delete exam results
-                ExamResult.query.filter_by(student_id=student.id).delete()
-                # Delete student record
-                db.session.delete(student)
+                delete_student_records(student)
             
             # Delete user
             db.session.delete(user)
@@ -2779,8 +5571,28 @@ def admin_system_config():
     config_type = request.form.get('config_type')
     
     if config_type == 'calendar':
-        # Process calendar configuration
-        # In a real app, this would save to a configuration table in the database
+        # Terms arrive as a JSON list of {name, academic_year, start, end}
+        try:
+            terms = json.loads(request.form.get('terms') or '[]')
+            calendar = []
+            for term in terms:
+                start = date.fromisoformat(term['start'])
+                end = date.fromisoformat(term['end'])
+                if end < start:
+                    raise ValueError(f"Term {term['name']} ends before it starts")
+                calendar.append({
+                    'name': term['name'],
+                    'academic_year': term.get('academic_year'),
+                    'start': start.isoformat(),
+                    'end': end.isoformat()
+                })
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({'success': False, 'message': f'Invalid calendar: {e}'})
+        
+        set_config_value('academic_calendar', calendar,
+                         description='Academic terms used for attendance periods',
+                         updated_by=current_user.id)
+        db.session.commit()
         return jsonify({'success': True, 'message': 'Calendar configuration updated'})
     
     elif config_type == 'branding':
@@ -2789,9 +5601,17 @@ def admin_system_config():
         return jsonify({'success': True, 'message': 'Branding configuration updated'})
     
     elif config_type == 'grading':
-        # Process grading system configuration
-        # In a real app, this would save to a configuration table in the database
-        return jsonify({'success': True, 'message': 'Grading system configuration updated'})
+        # Bands arrive as a JSON list of {grade, min} for one exam type
+        scale_name = request.form.get('exam_type') or DEFAULT_GRADING_SCALE
+        try:
+            version = save_grading_scale(scale_name, json.loads(request.form.get('scale') or '[]'),
+                                         updated_by=current_user.id)
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({'success': False, 'message': f'Invalid grading scale: {e}'})
+        
+        db.session.commit()
+        return jsonify({'success': True, 'message': f'Grading system configuration updated ({scale_name} version {version})',
+                        'version': version})
     
     return jsonify({'success': False, 'message': 'Invalid configuration type'})
 
@@ -2952,6 +5772,205 @@ def add_student():
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Error adding student: {str(e)}'})
 
+# Student admission import
+ADMISSION_IMPORT_FOLDER = os.path.join(app.instance_path, 'admission_imports')
+ADMISSION_REQUIRED_COLUMNS = ('username', 'password', 'email', 'first_name', 'last_name', 'admission_number',
+                              'date_of_birth', 'gender', 'class_name', 'section', 'admission_date')
+ADMISSION_OPTIONAL_COLUMNS = ('phone', 'father_name', 'mother_name', 'address', 'religion',
+                              'father_occupation', 'about', 'sponsorship_type')
+
+def validate_admission_rows(stream, filename):
+    """Validate an intake sheet, returning (rows, errors).
+
+    Uniqueness of usernames, emails and admission numbers is checked against
+    sets prefetched with one query each, and against earlier rows of the sheet.
+    Each error is a dict with row_number, column, value and reason.
+    """
+    usernames = {username for (username,) in db.session.query(User.username)}
+    emails = {email.lower() for (email,) in db.session.query(User.email) if email}
+    admission_numbers = {number.upper() for (number,) in db.session.query(Student.admission_number) if number}
+    
+    rows = []
+    errors = []
+    checked_columns = False
+    for row_number, row in iter_upload_rows(stream, filename):
+        if not checked_columns:
+            missing = [column for column in ADMISSION_REQUIRED_COLUMNS if column not in row]
+            if missing:
+                raise ValueError(f"Missing required columns: {', '.join(missing)}")
+            checked_columns = True
+        
+        values = {column: _clean_cell(row.get(column)) for column in ADMISSION_REQUIRED_COLUMNS + ADMISSION_OPTIONAL_COLUMNS}
+        row_errors = []
+        for column in ADMISSION_REQUIRED_COLUMNS:
+            if not values[column]:
+                row_errors.append((column, 'Required value missing'))
+        for column in ('date_of_birth', 'admission_date'):
+            if values[column]:
+                parsed = parse_upload_date(row.get(column))
+                if parsed is None:
+                    row_errors.append((column, 'Invalid date'))
+                values[column] = parsed
+        if values['email'] and '@' not in values['email']:
+            row_errors.append(('email', 'Invalid email address'))
+        if values['username'] in usernames:
+            row_errors.append(('username', 'Username already exists'))
+        if values['email'] and values['email'].lower() in emails:
+            row_errors.append(('email', 'Email already exists'))
+        if values['admission_number'] and values['admission_number'].upper() in admission_numbers:
+            row_errors.append(('admission_number', 'Admission number already exists'))
+        
+        if row_errors:
+            errors.extend({'row_number': row_number, 'column': column, 'value': _clean_cell(row.get(column)),
+                           'reason': reason} for column, reason in row_errors)
+        else:
+            rows.append(values)
+        # Later rows must not reuse values from this one, even if it had other errors
+        if values['username']:
+            usernames.add(values['username'])
+        if values['email']:
+            emails.add(values['email'].lower())
+        if values['admission_number']:
+            admission_numbers.add(values['admission_number'].upper())
+    return rows, errors
+
+def import_student_admissions(stream, filename, dry_run=False, chunk_size=1000, progress=None):
+    """Validate an intake sheet and, if every row is valid, create the users and students.
+
+    Users are inserted in chunks with RETURNING to collect their ids, then the
+    matching students, all in one transaction. Nothing is written on a dry run or
+    when any row has errors; errors go to a downloadable CSV. Returns a summary dict.
+    """
+    rows, errors = validate_admission_rows(stream, filename)
+    if progress:
+        progress(len(rows) + len({error['row_number'] for error in errors}))
+    summary = {'rows': len(rows) + len({error['row_number'] for error in errors}), 'valid': len(rows),
+               'imported': 0, 'errors': len(errors), 'errors_file': None, 'dry_run': dry_run}
+    
+    if errors:
+        write_import_errors(summary, ADMISSION_IMPORT_FOLDER, 'admission_errors', errors)
+    if dry_run or errors or not rows:
+        return summary
+    
+    user_columns = ('username', 'password', 'email', 'first_name', 'last_name', 'phone')
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            user_ids = db.session.execute(
+                db.insert(User).returning(User.id, sort_by_parameter_order=True),
+                [dict({column: row[column] for column in user_columns}, role='student') for row in chunk]
+            ).scalars().all()
+            db.session.execute(db.insert(Student), [
+                dict({column: row[column] or None for column in row if column not in user_columns}, user_id=user_id)
+                for row, user_id in zip(chunk, user_ids)
+            ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    summary['imported'] = len(rows)
+    return summary
+
+@import_handler('student_admissions', roles=('admin',), errors_folder=ADMISSION_IMPORT_FOLDER)
+def _student_admissions_job(stream, filename, params, progress):
+    return import_student_admissions(stream, filename, dry_run=bool(params.get('dry_run')), progress=progress)
+
+@app.route('/admin/import_students', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_import_students():
+    if request.method == 'POST':
+        file = request.files.get('students_file')
+        if not file or file.filename == '':
+            flash('No selected file', 'danger')
+            return redirect(request.url)
+        
+        dry_run = bool(request.form.get('dry_run'))
+        if request.form.get('background'):
+            job = queue_import_job('student_admissions', file, {'dry_run': dry_run}, created_by=current_user.id)
+            flash('The intake sheet has been queued for import', 'success')
+            return redirect(url_for('import_job_status', job_id=job.id))
+        
+        try:
+            summary = import_student_admissions(file.stream, file.filename, dry_run=dry_run)
+        except Exception as e:
+            flash(f'Error importing students: {str(e)}', 'danger')
+            return redirect(request.url)
+        
+        if summary['errors']:
+            flash(f"{summary['errors']} problems found in {summary['rows']} rows; no students were imported", 'warning')
+        elif dry_run:
+            flash(f"Dry run passed: {summary['valid']} students are ready to import", 'success')
+        else:
+            flash(f"Imported {summary['imported']} students", 'success')
+        return render_template('admin_import_students.html', summary=summary)
+    
+    return render_template('admin_import_students.html', summary=None)
+
+@app.route('/admin/import_students/errors/<path:filename>')
+@login_required
+@admin_required
+def admin_admission_import_errors(filename):
+    return send_from_directory(ADMISSION_IMPORT_FOLDER, secure_filename(filename), as_attachment=True)
+
+def import_job_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'filename': job.filename,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'error_count': job.error_count,
+        'summary': json.loads(job.summary) if job.summary else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        'status_url': url_for('import_job_status', job_id=job.id),
+        'errors_url': url_for('import_job_errors', job_id=job.id) if job.errors_file else None
+    }
+
+def get_visible_import_job(job_id):
+    """The job if the current user started it or is an admin, otherwise None"""
+    job = ImportJob.query.get_or_404(job_id)
+    if job.created_by != current_user.id and current_user.role != 'admin':
+        return None
+    return job
+
+@app.route('/imports')
+@login_required
+def import_jobs():
+    query = ImportJob.query
+    if current_user.role != 'admin':
+        query = query.filter_by(created_by=current_user.id)
+    jobs = query.order_by(ImportJob.id.desc()).limit(50).all()
+    if request.args.get('format') == 'json':
+        return jsonify({'jobs': [import_job_dict(job) for job in jobs]})
+    return render_template('import_jobs.html', jobs=jobs)
+
+@app.route('/imports/<int:job_id>')
+@login_required
+def import_job_status(job_id):
+    job = get_visible_import_job(job_id)
+    if job is None:
+        flash('You do not have permission to view this import', 'danger')
+        return redirect(url_for('dashboard'))
+    if request.args.get('format') == 'json':
+        return jsonify(import_job_dict(job))
+    return render_template('import_job.html', job=job, job_data=import_job_dict(job))
+
+@app.route('/imports/<int:job_id>/errors')
+@login_required
+def import_job_errors(job_id):
+    job = get_visible_import_job(job_id)
+    if job is None or current_user.role not in IMPORT_HANDLERS[job.kind].roles:
+        flash('You do not have permission to view this import', 'danger')
+        return redirect(url_for('dashboard'))
+    if not job.errors_file:
+        abort(404)
+    return send_from_directory(IMPORT_HANDLERS[job.kind].errors_folder, job.errors_file, as_attachment=True)
+
 @app.route('/admin/add_staff', methods=['POST'])
 @login_required
 @admin_required
@@ -3012,17 +6031,8 @@ def delete_student(student_id):
         student = Student.query.get_or_404(student_id)
         user_id = student.user_id
         
-        # Delete attendance records
-        Attendance.query.filter_by(student_id=student.id).delete()
-        
-        # Delete exam results
-        ExamResult.query.filter_by(student_id=student.id).delete()
-        
-        # Delete course enrollments
-        CourseEnrollment.query.filter_by(student_id=student.id).delete()
-        
-        # Delete student record
-        db.session.delete(student)
+        # Delete the student with their attendance, results, enrollments and ledger summary
+        delete_student_records(student)
         
         # Delete user account
         user = User.query.get(user_id)
@@ -3242,33 +6252,22 @@ def lecturer_mark_attendance(course_id):
     if request.method == 'POST':
         date_str = request.form.get('date')
         attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        period = request.form.get('period', 1, type=int)
         
         # Get all enrollments for this course
-        enrollments = CourseEnrollment.query.filter_by(course_id=course.id).all()
+        enrolled_ids = [student_id for (student_id,) in db.session.query(
+            CourseEnrollment.student_id
+        ).filter_by(course_id=course.id)]
         
-        for enrollment in enrollments:
-            status_key = f'status_{enrollment.student_id}'
-            if status_key in request.form:
-                status = request.form.get(status_key)
-                
-                # Check if attendance record already exists
-                existing = Attendance.query.filter_by(
-                    student_id=enrollment.student_id,
-                    date=attendance_date
-                ).first()
-                
-                if existing:
-                    existing.status = status
-                else:
-                    new_attendance = Attendance(
-                        student_id=enrollment.student_id,
-                        date=attendance_date,
-                        status=status
-                    )
-                    db.session.add(new_attendance)
+        statuses = {
+            student_id: request.form.get(f'status_{student_id}')
+            for student_id in enrolled_ids if f'status_{student_id}' in request.form
+        }
         
+        inserted, updated = record_course_attendance(course.id, attendance_date, period, statuses,
+                                                     taken_by=current_user.id)
         db.session.commit()
-        flash('Attendance marked successfully', 'success')
+        flash(f'Attendance marked successfully ({inserted} added, {updated} updated)', 'success')
         return redirect(url_for('lecturer_course_detail', course_id=course_id))
     
     # Get students enrolled in this course
@@ -3284,9 +6283,23 @@ def lecturer_mark_attendance(course_id):
             'admission_number': student.admission_number
         })
     
+    # Pre-fill marks when reopening an existing session
+    session_date = get_date_arg('date') or datetime.now().date()
+    period = request.args.get('period', 1, type=int)
+    marks = dict(db.session.query(CourseAttendance.student_id, CourseAttendance.status).join(
+        CourseAttendanceSession, CourseAttendance.session_id == CourseAttendanceSession.id
+    ).filter(
+        CourseAttendanceSession.course_id == course.id,
+        CourseAttendanceSession.date == session_date,
+        CourseAttendanceSession.period == period
+    ))
+    
     return render_template('lecturer_mark_attendance.html', 
                            course=course,
                            students=students_data,
+                           marks=marks,
+                           period=period,
+                           session_date=session_date,
                            today=datetime.now())
 
 # Admin Report Routes
@@ -3337,29 +6350,14 @@ def admin_generate_report_file():
             df = pd.DataFrame(data)
             
         elif report_type == 'financial':
-            # Create financial report
-            invoices = Invoice.query.all()
-            
-            data = []
-            for invoice in invoices:
-                student = Student.query.get(invoice.student_id)
-                user = User.query.get(student.user_id)
-                
-                data.append({
-                    'Invoice Number': invoice.invoice_number,
-                    'Student': f"{user.first_name} {user.last_name}",
-                    'Admission Number': student.admission_number,
-                    'Issue Date': invoice.issue_date,
-                    'Due Date': invoice.due_date,
-                    'Total Amount': invoice.total_amount,
-                    'Paid Amount': invoice.paid_amount,
-                    'Balance': invoice.total_amount - invoice.paid_amount,
-                    'Status': invoice.status,
-                    'Semester': invoice.semester,
-                    'Academic Year': invoice.academic_year
-                })
-            
-            df = pd.DataFrame(data)
+            # Financial reports are streamed by a separate download route
+            export_format = report_format if report_format in FINANCIAL_EXPORT_FORMATS else 'csv'
+            return jsonify({
+                'success': True,
+                'message': f'Financial report for {report_period} period is ready to download in {export_format.upper()} format',
+                'filename': f"financial_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}",
+                'download_url': url_for('admin_download_financial_report', export_format=export_format)
+            })
         
         else:
             # Placeholder for other report types
@@ -3383,6 +6381,89 @@ def admin_generate_report_file():
             'message': str(e)
         })
 
+# Financial report export
+FINANCIAL_EXPORT_FORMATS = ('csv', 'xlsx')
+
+FINANCIAL_REPORT_COLUMNS = [
+    'Invoice Number', 'Student', 'Admission Number', 'Issue Date', 'Due Date', 'Total Amount',
+    'Paid Amount', 'Balance', 'Status', 'Semester', 'Academic Year'
+]
+
+def iter_financial_report_rows(batch_size=1000):
+    """Yield one list per invoice from a single joined query, fetched batch_size rows at a time"""
+    query = db.session.query(
+        Invoice.invoice_number, User.first_name, User.last_name, Student.admission_number,
+        Invoice.issue_date, Invoice.due_date, Invoice.total_amount, Invoice.paid_amount,
+        Invoice.status, Invoice.semester, Invoice.academic_year
+    ).join(
+        Student, Student.id == Invoice.student_id
+    ).join(
+        User, User.id == Student.user_id
+    ).order_by(Invoice.id).yield_per(batch_size)
+    
+    for row in query:
+        total_amount = row.total_amount or 0
+        paid_amount = row.paid_amount or 0
+        yield [
+            row.invoice_number,
+            f"{row.first_name} {row.last_name}",
+            row.admission_number,
+            row.issue_date,
+            row.due_date,
+            total_amount,
+            paid_amount,
+            total_amount - paid_amount,
+            row.status,
+            row.semester,
+            row.academic_year
+        ]
+
+def stream_financial_report_csv(batch_size=1000):
+    """Generate the financial report as CSV text in chunks of batch_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FINANCIAL_REPORT_COLUMNS)
+    for count, row in enumerate(iter_financial_report_rows(batch_size), start=1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route('/admin/reports/financial.<export_format>')
+@login_required
+@admin_required
+def admin_download_financial_report(export_format):
+    if export_format not in FINANCIAL_EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Unsupported report format'}), 400
+    
+    filename = f"financial_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    
+    if export_format == 'csv':
+        return Response(
+            stream_with_context(stream_financial_report_csv()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    # Write-only workbooks flush rows to disk as they are appended
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Financial Report')
+    worksheet.append(FINANCIAL_REPORT_COLUMNS)
+    for row in iter_financial_report_rows():
+        worksheet.append(row)
+    
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=filename
+    )
+
 # Connect to Supabase
 @app.route('/admin/connect_supabase')
 @login_required
@@ -3411,4 +6492,15 @@ if __name__ == '__main__':
     scheduler_thread.daemon = True
     scheduler_thread.start()
     
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    # Keep the attendance risk table current
+    risk_thread = threading.Thread(target=refresh_attendance_risk_periodically)
+    risk_thread.daemon = True
+    risk_thread.start()
+    
+    # Pick up imports queued before a restart, in the serving process only: with debug on
+    # the reloader also runs this block in its watcher process
+    debug = True
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        resume_import_jobs()
+    
+    app.run(host='0.0.0.0', port=8080, debug=debug)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# Point the app at a throwaway file-backed database before main is imported
+_database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_database_dir, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def app_context(monkeypatch, tmp_path):
+    # Keep import reports and uploads out of the real instance folder
+    for name in dir(main):
+        if name.endswith('_FOLDER') and isinstance(getattr(main, name), str):
+            monkeypatch.setattr(main, name, str(tmp_path / name.lower()))
+    with main.app.app_context():
+        main.db.drop_all()
+        main.db.create_all()
+        yield main.app
+        main.db.session.remove()
+
+
+class QueryCounter:
+    """Count statements sent to the database while the block runs"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(main.db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(main.db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+@pytest.fixture
+def query_counter():
+    return QueryCounter
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Capture render_template calls instead of rendering, since tests run without templates"""
+    calls = []
+
+    def fake_render(name, **context):
+        calls.append((name, context))
+        return name
+
+    monkeypatch.setattr(main, 'render_template', fake_render)
+    return calls
+
+
+@pytest.fixture
+def login_client(app_context):
+    """Return a test client logged in as a new user with the given role"""
+    def make_client(role):
+        user = main.User(username=f'{role}_user', password='x', email=f'{role}@example.com', role=role,
+                         first_name=role, last_name='User')
+        main.db.session.add(user)
+        main.db.session.commit()
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return make_client
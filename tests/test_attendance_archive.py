@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+import main
+from main import db
+
+TERM_START = date(2026, 1, 5)
+TERM_END = date(2026, 3, 27)
+
+
+def _add_attendance(student_id, statuses, start=TERM_START):
+    db.session.add_all([
+        main.Attendance(student_id=student_id, date=start + timedelta(days=day), status=status)
+        for day, status in enumerate(statuses)
+    ])
+    db.session.commit()
+
+
+def test_rows_with_unknown_statuses_stay_live(app_context):
+    _add_attendance(1, ['Present', 'Excused', 'Absent', 'Late Coming'])
+    before = main.attendance_status_counts(1, TERM_START, TERM_END)
+
+    students, archived, skipped = main.archive_attendance(TERM_START, TERM_END, 'Term 1')
+
+    assert (students, archived, skipped) == (1, 3, 1)
+    assert [row.status for row in main.Attendance.query.all()] == ['Excused']
+    assert main.attendance_status_counts(1, TERM_START, TERM_END) == before
+
+
+def test_rearchiving_after_the_term_end_changes_merges_into_the_archive(app_context):
+    _add_attendance(1, ['Present', 'Absent'])
+    main.archive_attendance(TERM_START, TERM_END, 'Term 1')
+
+    # The term is extended in the calendar and a late register is loaded
+    new_end = TERM_END + timedelta(days=14)
+    _add_attendance(1, ['Late Coming'], start=new_end)
+    main.archive_attendance(TERM_START, new_end, 'Term 1')
+
+    archive = main.AttendanceArchive.query.one()
+    assert archive.end_date == new_end
+    assert main.Attendance.query.count() == 0
+    assert main.attendance_status_counts(1, TERM_START, new_end) == {'Present': 1, 'Absent': 1, 'Late Coming': 1}
+
+    # Shortening the term again keeps the days already archived beyond the new end
+    main.archive_attendance(TERM_START, TERM_END, 'Term 1')
+    assert main.AttendanceArchive.query.one().end_date == new_end
+    assert main.attendance_status_counts(1, TERM_START, new_end) == {'Present': 1, 'Absent': 1, 'Late Coming': 1}
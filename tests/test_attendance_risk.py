@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+import main
+from main import db
+
+AS_OF = date(2026, 3, 31)
+
+
+def _risk_rows():
+    columns = [f'{field}_{days}' for days in main.ATTENDANCE_RISK_WINDOWS for field in main.RISK_COUNT_FIELDS]
+    return {row.student_id: tuple(getattr(row, column) for column in columns)
+            for row in main.StudentAttendanceRisk.query.all()}
+
+
+def test_back_dated_attendance_reaches_the_next_refresh(app_context):
+    students = [main.Student(admission_number=f'ADM{i:05d}', class_name='Grade 11', section='A') for i in range(3)]
+    db.session.add_all(students)
+    db.session.commit()
+    main.upsert_attendance([
+        {'student_id': student.id, 'date': AS_OF - timedelta(days=day), 'status': 'Present'}
+        for student in students for day in range(40)
+    ])
+    db.session.commit()
+    main.refresh_attendance_risk(AS_OF)
+
+    # A register for days already processed is imported after the refresh
+    main.upsert_attendance([
+        {'student_id': students[0].id, 'date': AS_OF - timedelta(days=day), 'status': 'Absent'}
+        for day in range(2, 12)
+    ])
+    db.session.commit()
+    assert main.get_config_value('attendance_risk_stale_from') == (AS_OF - timedelta(days=11)).isoformat()
+
+    main.refresh_attendance_risk(AS_OF + timedelta(days=1))
+    incremental = _risk_rows()
+    main.refresh_attendance_risk(AS_OF + timedelta(days=1), rebuild=True)
+
+    assert incremental == _risk_rows()
+    # The 7-day window ending April 1 holds March 26-31, four of them now absent
+    assert incremental[students[0].id][:2] == (6, 4)
+    assert main.get_config_value('attendance_risk_stale_from') is None
+    assert main.get_config_value('attendance_risk_as_of') == (AS_OF + timedelta(days=1)).isoformat()
+
+
+def test_writes_outside_processed_windows_do_not_force_a_rebuild(app_context):
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.commit()
+    main.upsert_attendance([{'student_id': student.id, 'date': AS_OF, 'status': 'Present'}])
+    db.session.commit()
+    main.refresh_attendance_risk(AS_OF)
+
+    main.upsert_attendance([{'student_id': student.id, 'date': AS_OF + timedelta(days=1), 'status': 'Absent'}])
+    main.upsert_attendance([{'student_id': student.id, 'date': AS_OF - timedelta(days=200), 'status': 'Absent'}])
+    db.session.commit()
+
+    assert main.get_config_value('attendance_risk_stale_from') is None
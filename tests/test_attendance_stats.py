@@ -0,0 +1,79 @@
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import main
+from main import db
+
+DAYS = 200
+START = date(2026, 1, 1)
+STATUSES = ['Present', 'Present', 'Present', 'Late Coming', 'Half Day Present', 'Absent']
+MONTH = (date(2026, 3, 1), date(2026, 3, 31))
+# The timing benchmark only runs when ATTENDANCE_BENCH_ROWS is set, e.g. to 10000000
+BENCH_ROWS = int(os.environ.get('ATTENDANCE_BENCH_ROWS') or 0)
+
+
+def _fill_attendance(first_student, last_student):
+    """Insert DAYS of attendance for each student id in [first_student, last_student)"""
+    connection = db.engine.raw_connection()
+    try:
+        connection.executemany('INSERT INTO attendance (student_id, date, status) VALUES (?, ?, ?)', (
+            (student_id, (START + timedelta(days=day)).isoformat(), STATUSES[(student_id + day) % len(STATUSES)])
+            for student_id in range(first_student, last_student)
+            for day in range(DAYS)
+        ))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _median_latency(student_ids, start, end):
+    timings = []
+    for student_id in student_ids:
+        began = time.perf_counter()
+        main.student_attendance_stats(student_id, start, end)
+        timings.append(time.perf_counter() - began)
+    return statistics.median(timings)
+
+
+def test_attendance_stats_counts_statuses_in_range(app_context):
+    _fill_attendance(1, 3)
+    stats = main.student_attendance_stats(1, date(2026, 1, 1), date(2026, 1, 12))
+
+    expected = [STATUSES[(1 + day) % len(STATUSES)] for day in range(12)]
+    assert stats['total'] == 12
+    assert stats['present'] == expected.count('Present')
+    assert stats['late'] == expected.count('Late Coming')
+    assert stats['half_day'] == expected.count('Half Day Present')
+    assert stats['absent'] == expected.count('Absent')
+    assert stats['present_percent'] == expected.count('Present') / 12 * 100
+
+
+def test_attendance_stats_uses_two_indexed_queries(app_context, query_counter):
+    _fill_attendance(1, 51)
+
+    with query_counter() as queries:
+        main.student_attendance_stats(50, *MONTH)
+    plan = db.session.execute(db.text(
+        'EXPLAIN QUERY PLAN SELECT status, count(id) FROM attendance '
+        'WHERE student_id = :student_id AND date >= :start AND date <= :end GROUP BY status'
+    ), {'student_id': 1, 'start': MONTH[0].isoformat(), 'end': MONTH[1].isoformat()}).all()
+
+    assert queries.count == 2
+    assert any('USING INDEX uq_attendance_student_date' in row[-1] for row in plan)
+
+
+@pytest.mark.skipif(not BENCH_ROWS, reason='set ATTENDANCE_BENCH_ROWS to run the latency benchmark')
+def test_attendance_stats_latency_is_flat_as_the_table_grows(app_context):
+    small_students = 50
+    sample = range(1, small_students + 1)
+
+    _fill_attendance(1, small_students + 1)
+    small = _median_latency(sample, *MONTH)
+    _fill_attendance(small_students + 1, BENCH_ROWS // DAYS + 1)
+    large = _median_latency(sample, *MONTH)
+
+    assert large < small * 3 + 0.002
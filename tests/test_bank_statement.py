@@ -0,0 +1,94 @@
+import csv
+import io
+import os
+from datetime import date
+
+import main
+from main import db
+
+
+def _statement(rows):
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=['date', 'amount', 'transaction_id', 'invoice_number', 'admission_number'])
+    writer.writeheader()
+    writer.writerows(rows)
+    return io.BytesIO(text.getvalue().encode())
+
+
+def _exception_reasons(summary):
+    with open(os.path.join(main.PAYMENT_IMPORT_FOLDER, summary['exceptions_file']), newline='') as handle:
+        return {row['transaction_id']: row['reason'] for row in csv.DictReader(handle)}
+
+
+def test_statement_rows_never_overpay_invoices(app_context):
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    paid = main.Invoice(student_id=student.id, invoice_number='INV-2026-0001', issue_date=date(2026, 1, 1),
+                        due_date=date(2026, 1, 31), total_amount=100, paid_amount=100, status='Paid')
+    open_invoice = main.Invoice(student_id=student.id, invoice_number='INV-2026-0002', issue_date=date(2026, 2, 1),
+                                due_date=date(2026, 2, 28), total_amount=200, paid_amount=0, status='Unpaid')
+    db.session.add_all([paid, open_invoice])
+    db.session.commit()
+    main.rebuild_student_balances()
+
+    summary = main.import_bank_statement(_statement([
+        {'date': '2026-03-01', 'amount': '50', 'transaction_id': 'T1', 'invoice_number': 'INV-2026-0001'},
+        {'date': '2026-03-01', 'amount': '300', 'transaction_id': 'T2', 'admission_number': 'ADM00001'},
+        {'date': '2026-03-01', 'amount': '250', 'transaction_id': 'T3', 'invoice_number': 'INV-2026-0002'},
+        {'date': '2026-03-01', 'amount': '150', 'transaction_id': 'T4', 'admission_number': 'adm00001'},
+        {'date': '2026-03-02', 'amount': '60', 'transaction_id': 'T5', 'invoice_number': 'INV-2026-0002'}
+    ]), 'statement.csv', recorded_by=None)
+
+    assert summary['matched'] == 1
+    assert _exception_reasons(summary) == {
+        'T1': 'Invoice is already paid',
+        'T2': 'Amount exceeds the invoice balance of 200.00',
+        'T3': 'Amount exceeds the invoice balance of 200.00',
+        'T5': 'Amount exceeds the invoice balance of 50.00'
+    }
+    db.session.refresh(open_invoice)
+    assert open_invoice.paid_amount == 150
+    assert open_invoice.status == 'Partially Paid'
+    assert db.session.get(main.StudentBalance, student.id).balance == 50
+
+
+def test_failed_import_applies_nothing_and_can_be_retried(app_context, monkeypatch):
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    invoice = main.Invoice(student_id=student.id, invoice_number='INV-2026-0001', issue_date=date(2026, 1, 1),
+                           due_date=date(2026, 1, 31), total_amount=100, paid_amount=0, status='Unpaid')
+    db.session.add(invoice)
+    db.session.commit()
+    main.rebuild_student_balances()
+    rows = [
+        {'date': '2026-03-01', 'amount': '30', 'invoice_number': 'INV-2026-0001'},
+        {'date': '2026-03-02', 'amount': '20', 'invoice_number': 'INV-2026-0001'}
+    ]
+
+    update_rollups = main.update_finance_rollups
+    calls = []
+
+    def fail_on_second_batch(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError('disk full')
+        update_rollups(*args, **kwargs)
+
+    monkeypatch.setattr(main, 'update_finance_rollups', fail_on_second_batch)
+    try:
+        main.import_bank_statement(_statement(rows), 'statement.csv', recorded_by=None, batch_size=1)
+    except RuntimeError:
+        db.session.rollback()
+    assert len(calls) == 2
+    assert main.Payment.query.count() == 0
+
+    monkeypatch.setattr(main, 'update_finance_rollups', update_rollups)
+    summary = main.import_bank_statement(_statement(rows), 'statement.csv', recorded_by=None, batch_size=1)
+
+    assert summary['matched'] == 2
+    assert main.Payment.query.count() == 2
+    db.session.refresh(invoice)
+    assert invoice.paid_amount == 50
+    assert db.session.get(main.StudentBalance, student.id).balance == 50
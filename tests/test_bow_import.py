@@ -0,0 +1,37 @@
+import csv
+import io
+import os
+
+import main
+from main import db
+
+
+def _sheet(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(['Admission Number', 'subject_code', 'subject_name', 'credit_hours', 'marks'])
+    writer.writerows(rows)
+    return io.BytesIO(text.getvalue().encode())
+
+
+def test_bow_import_replaces_valid_students_and_reports_the_rest(app_context):
+    exam = main.FinalExam(name='Finals')
+    students = [main.Student(admission_number=f'ADM{i:05d}', class_name='Grade 11', section='A') for i in range(3)]
+    db.session.add_all([exam] + students)
+    db.session.flush()
+    db.session.add(main.BOWCorporationResult(student_id=students[1].id, exam_id=exam.id, subject_code='OLD',
+                                             subject_name='Old', credit_hours=1, marks=1, grade='F'))
+    db.session.commit()
+
+    rows = [(' adm00000 ', f'C{i}', 'Course', 3, 90 - i * 10) for i in range(5)]
+    rows += [('ADM00001', f'C{i}', 'Course', 3, 'n/a' if i == 0 else 70) for i in range(4)]
+    rows += [('ADM00002', 'C0', 'Course', 3, 50), ('UNKNOWN', 'C0', 'Course', 3, 50)]
+    summary = main.import_bow_result_sheet(exam.id, _sheet(rows), 'results.csv')
+
+    assert (summary['students'], summary['results'], summary['skipped_students']) == (1, 5, 2)
+    grades = [result.grade for result in main.BOWCorporationResult.query.filter_by(student_id=students[0].id)]
+    assert grades == ['A-', 'B-', 'C-', 'D', 'F']
+    assert [result.subject_code for result in students[1].bow_results] == ['OLD']
+    with open(os.path.join(main.BOW_IMPORT_FOLDER, summary['errors_file']), newline='') as handle:
+        errors = [(row['row_number'], row['column']) for row in csv.DictReader(handle)]
+    assert errors == [('7', 'marks'), ('11', 'admission_number'), ('12', 'admission_number')]
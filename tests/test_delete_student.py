@@ -0,0 +1,53 @@
+from datetime import date
+
+import pytest
+
+import main
+from main import db
+
+STUDENT_TABLES = [
+    main.Attendance, main.AttendanceArchive, main.ExamResult, main.CourseEnrollment,
+    main.CourseAttendance, main.CourseAttendanceSummary, main.StudentBalance, main.StudentAttendanceRisk
+]
+
+
+def _student_with_records():
+    user = main.User(username='ADM00001', password='x', email='adm00001@example.com', role='student',
+                     first_name='Test', last_name='Student')
+    course = main.Course(course_code='MATH101', course_name='Mathematics')
+    db.session.add_all([user, course])
+    db.session.flush()
+    student = main.Student(user_id=user.id, admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    course_session = main.CourseAttendanceSession(course_id=course.id, date=date(2026, 3, 2))
+    db.session.add(course_session)
+    db.session.flush()
+    db.session.add_all([
+        main.Attendance(student_id=student.id, date=date(2026, 3, 2), status='Present'),
+        main.AttendanceArchive(student_id=student.id, start_date=date(2026, 1, 5), end_date=date(2026, 1, 9),
+                               data=b'\x11\x11\x01'),
+        main.CourseEnrollment(student_id=student.id, course_id=course.id),
+        main.CourseAttendance(session_id=course_session.id, student_id=student.id, status='Present'),
+        main.CourseAttendanceSummary(course_id=course.id, student_id=student.id, present=1, total=1),
+        main.StudentBalance(student_id=student.id),
+        main.StudentAttendanceRisk(student_id=student.id, records_7=5, absent_7=2)
+    ])
+    db.session.commit()
+    return student.id, user.id
+
+
+@pytest.mark.parametrize('path', ['delete_student', 'admin_users'])
+def test_both_delete_paths_remove_every_student_row(login_client, path):
+    client = login_client('admin')
+    student_id, user_id = _student_with_records()
+
+    if path == 'delete_student':
+        response = client.post(f'/admin/delete_student/{student_id}')
+    else:
+        response = client.post('/admin/users', data={'action': 'delete', 'user_id': user_id})
+
+    assert response.get_json()['success']
+    assert db.session.get(main.Student, student_id) is None
+    for model in STUDENT_TABLES:
+        assert model.query.filter_by(student_id=student_id).count() == 0, model.__name__
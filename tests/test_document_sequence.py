@@ -0,0 +1,67 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import main
+from main import db
+
+THREADS = 16
+CALLS_PER_THREAD = 10
+BLOCK = 3
+
+
+def _reserve_blocks(year):
+    def worker(_):
+        with main.app.app_context():
+            return [main.reserve_document_numbers('INV', BLOCK, year=year) for _ in range(CALLS_PER_THREAD)]
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        return [block for blocks in pool.map(worker, range(THREADS)) for block in blocks]
+
+
+def _value(number):
+    return int(re.fullmatch(r'INV-\d{4}-(\d+)', number).group(1))
+
+
+def test_concurrent_reservations_are_unique_and_contiguous(app_context):
+    blocks = _reserve_blocks(2026)
+
+    numbers = [number for block in blocks for number in block]
+    assert len(numbers) == THREADS * CALLS_PER_THREAD * BLOCK
+    assert len(set(numbers)) == len(numbers)
+    for block in blocks:
+        values = [_value(number) for number in block]
+        assert values == list(range(values[0], values[0] + BLOCK))
+    assert sorted(_value(number) for number in numbers) == list(range(1, len(numbers) + 1))
+
+
+def test_sequence_is_seeded_from_existing_numbers(app_context):
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    for number in ('INV-2025-0007', 'INV-2025-0042', 'INV-2024-0100'):
+        db.session.add(main.Invoice(
+            student_id=student.id, invoice_number=number, issue_date=date(2025, 1, 1),
+            due_date=date(2025, 2, 1), total_amount=10
+        ))
+    db.session.commit()
+
+    blocks = _reserve_blocks(2025)
+
+    values = sorted(_value(number) for block in blocks for number in block)
+    assert values == list(range(43, 43 + THREADS * CALLS_PER_THREAD * BLOCK))
+    assert main.reserve_document_numbers('INV', year=2024) == ['INV-2024-0101']
+
+
+def test_billing_run_numbers_invoices_in_its_issue_year(app_context):
+    db.session.add(main.Student(admission_number='ADM00001', class_name='Grade 11', section='A'))
+    db.session.add(main.FeeTemplate(class_name='Grade 11', description='Tuition', amount=100))
+    run = main.BillingRun(
+        semester='Term 1', academic_year='2030', issue_date=date(2030, 1, 5), due_date=date(2030, 2, 5)
+    )
+    db.session.add(run)
+    db.session.commit()
+
+    main.run_term_billing(run)
+
+    assert [invoice.invoice_number for invoice in main.Invoice.query.all()] == ['INV-2030-0001']
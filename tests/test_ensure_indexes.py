@@ -0,0 +1,42 @@
+from datetime import date
+
+import main
+from main import db
+
+
+def _index_names():
+    return set(db.session.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+
+
+def _add_duplicate_attendance():
+    db.session.execute(db.text('DROP INDEX uq_attendance_student_date'))
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    for status in ('Absent', 'Present'):
+        db.session.add(main.Attendance(student_id=student.id, date=date(2026, 3, 2), status=status))
+    db.session.add(main.Attendance(student_id=student.id, date=date(2026, 3, 3), status='Present'))
+    db.session.commit()
+
+
+def test_startup_leaves_duplicates_and_skips_the_unique_index(app_context, caplog):
+    _add_duplicate_attendance()
+
+    main.ensure_indexes()
+
+    assert 'uq_attendance_student_date' not in _index_names()
+    assert main.Attendance.query.count() == 3
+    assert 'attendance has 1 duplicate rows' in caplog.text
+
+
+def test_remove_duplicate_rows_keeps_the_newest_and_creates_the_index(app_context):
+    _add_duplicate_attendance()
+    version = main.get_data_version('attendance')
+
+    result = main.app.test_cli_runner().invoke(args=['remove-duplicate-rows'])
+
+    assert result.exit_code == 0
+    assert 'Removed 1 duplicate rows from attendance' in result.output
+    assert 'uq_attendance_student_date' in _index_names()
+    assert sorted(row.status for row in main.Attendance.query.all()) == ['Present', 'Present']
+    assert main.get_data_version('attendance') == version + 1
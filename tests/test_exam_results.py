@@ -0,0 +1,66 @@
+from datetime import date
+
+import main
+from main import db
+
+
+def _setup():
+    exam = main.Exam(name='Midterm', exam_type='Quiz', subject='Maths', date=date(2026, 3, 1))
+    users = [main.User(username=f's{i}', password='x', email=f's{i}@example.com', role='student',
+                       first_name=f'Student{i}', last_name='L') for i in range(3)]
+    db.session.add_all([exam] + users)
+    db.session.flush()
+    students = [main.Student(user_id=user.id, admission_number=f'ADM{i:05d}', class_name='Grade 11', section='A')
+                for i, user in enumerate(users)]
+    db.session.add_all(students)
+    db.session.commit()
+    return exam, students
+
+
+def test_exam_results_are_cached_with_their_query(app_context, query_counter):
+    exam, students = _setup()
+    main.upsert_exam_results(exam.id, {students[0].id: {'grade': 'A', 'percentage': 90},
+                                       students[1].id: {'grade': 'B', 'percentage': 80}})
+    db.session.commit()
+
+    results, statistics = main.get_exam_results(exam.id)
+    assert [row['rank'] for row in results] == [1, 2]
+    with query_counter() as queries:
+        assert main.get_exam_results(exam.id) == (results, statistics)
+    assert queries.count == 0
+
+
+def test_any_writer_refreshes_cached_exam_results(app_context):
+    exam, students = _setup()
+    main.upsert_exam_results(exam.id, {students[0].id: {'grade': 'B', 'percentage': 80}})
+    db.session.commit()
+    assert main.get_exam_results(exam.id)[1]['count'] == 1
+
+    # Bulk upsert outside add_result
+    main.upsert_exam_results(exam.id, {students[1].id: {'grade': 'A', 'percentage': 95}})
+    assert main.get_exam_results(exam.id)[1]['count'] == 1  # not committed yet
+    db.session.commit()
+    results, statistics = main.get_exam_results(exam.id)
+    assert statistics['count'] == 2
+    assert results[1]['rank'] == 1
+
+    # ORM edit of a single result
+    main.ExamResult.query.filter_by(student_id=students[0].id).one().percentage = 99
+    db.session.commit()
+    assert main.get_exam_results(exam.id)[0][0]['rank'] == 1
+
+    # Renaming a student
+    students[1].user.first_name = 'Renamed'
+    db.session.commit()
+    assert main.get_exam_results(exam.id)[0][1]['name'] == 'Renamed L'
+
+
+def test_regrading_refreshes_cached_exam_results(app_context):
+    exam, students = _setup()
+    main.upsert_exam_results(exam.id, {students[0].id: {'grade': 'Z', 'percentage': 91}})
+    db.session.commit()
+    assert main.get_exam_results(exam.id)[0][0]['grade'] == 'Z'
+
+    main.regrade_results(exam_type='Quiz')
+
+    assert main.get_exam_results(exam.id)[0][0]['grade'] == 'A-'
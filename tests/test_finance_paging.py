@@ -0,0 +1,44 @@
+from datetime import date, datetime
+
+import main
+from main import db
+
+
+def _walk(client, rendered, url, items_key):
+    seen = []
+    cursor = None
+    while True:
+        client.get(url, query_string={'per_page': 2, 'cursor': cursor or ''})
+        context = rendered[-1][1]
+        seen.extend(item.id for item in context[items_key])
+        cursor = context['next_cursor']
+        if not cursor:
+            return seen
+
+
+def test_invoice_and_payment_pages_reach_rows_without_dates(login_client, rendered):
+    client = login_client('accounts')
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add(student)
+    db.session.flush()
+    issue_dates = [date(2026, 3, 1), None, date(2026, 1, 1), None, date(2026, 2, 1), date(2026, 3, 1), None]
+    invoices = [main.Invoice(student_id=student.id, invoice_number=f'INV-2026-{i:04d}', issue_date=issue_date,
+                             total_amount=100, status='Unpaid', created_at=datetime(2026, 1, 15 + i))
+                for i, issue_date in enumerate(issue_dates)]
+    db.session.add_all(invoices)
+    db.session.flush()
+    db.session.add_all([
+        main.Payment(invoice_id=invoice.id, payment_date=invoice.issue_date, amount=10,
+                     created_at=datetime(2026, 1, 15 + i))
+        for i, invoice in enumerate(invoices)
+    ])
+    db.session.commit()
+
+    invoice_ids = _walk(client, rendered, '/accounts/invoices', 'invoices')
+    payment_ids = _walk(client, rendered, '/accounts/payments', 'payments')
+
+    assert sorted(invoice_ids) == sorted(invoice.id for invoice in invoices)
+    assert len(payment_ids) == len(set(payment_ids)) == len(invoices)
+    listed = [next(i for i in invoices if i.id == invoice_id) for invoice_id in invoice_ids]
+    list_dates = [invoice.issue_date or invoice.created_at.date() for invoice in listed]
+    assert list_dates == sorted(list_dates, reverse=True)
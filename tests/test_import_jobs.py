@@ -0,0 +1,83 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import main
+from main import db
+
+
+@pytest.fixture
+def run_inline(monkeypatch):
+    """Run queued jobs synchronously and record every progress report"""
+    reports = []
+    handler = main.IMPORT_HANDLERS['bow_results']
+
+    def recording_run(stream, filename, params, progress):
+        def record(processed, total=None):
+            reports.append((processed, total, main.BOWCorporationResult.query.count()))
+            progress(processed, total)
+        return handler.run(stream, filename, params, record)
+
+    monkeypatch.setitem(main.IMPORT_HANDLERS, 'bow_results', handler._replace(run=recording_run))
+    monkeypatch.setattr(main.import_executor, 'submit', lambda fn, *args: fn(*args))
+    return reports
+
+
+def _upload(text, filename='results.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode()), filename=filename)
+
+
+def test_completed_job_reports_full_progress_only_after_writes(app_context, run_inline, monkeypatch):
+    monkeypatch.setattr(main, 'BOW_PROGRESS_ROWS', 2)
+    exam = main.FinalExam(name='Finals')
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add_all([exam, student])
+    db.session.commit()
+    sheet = 'admission_number,subject_code,subject_name,credit_hours,marks\n' + ''.join(
+        f'ADM00001,C{i},Course,3,{60 + i}\n' for i in range(4))
+
+    job = main.queue_import_job('bow_results', _upload(sheet), {'final_exam_id': exam.id})
+
+    db.session.refresh(job)
+    assert job.status == 'Completed'
+    assert run_inline == [(2, None, 0), (4, None, 0), (4, 4, 4)]
+    assert os.listdir(main.IMPORT_JOB_FOLDER) == []
+
+
+def test_failed_job_removes_its_upload(app_context, run_inline):
+    exam = main.FinalExam(name='Finals')
+    db.session.add(exam)
+    db.session.commit()
+
+    job = main.queue_import_job('bow_results', _upload('marks\n1\n'), {'final_exam_id': exam.id})
+
+    db.session.refresh(job)
+    assert job.status == 'Failed'
+    assert 'Missing columns' in job.error
+    assert os.listdir(main.IMPORT_JOB_FOLDER) == []
+
+
+def test_resume_command_fails_interrupted_jobs_and_runs_queued_ones(app_context, monkeypatch):
+    exam = main.FinalExam(name='Finals')
+    student = main.Student(admission_number='ADM00001', class_name='Grade 11', section='A')
+    db.session.add_all([exam, student])
+    db.session.commit()
+    sheet = 'admission_number,subject_code,subject_name,credit_hours,marks\nADM00001,C1,Course,3,70\n'
+    monkeypatch.setattr(main.import_executor, 'submit', lambda fn, *args: None)
+    interrupted = main.queue_import_job('bow_results', _upload(sheet), {'final_exam_id': exam.id})
+    queued = main.queue_import_job('bow_results', _upload(sheet), {'final_exam_id': exam.id})
+    interrupted.status = 'Running'
+    db.session.commit()
+    monkeypatch.setattr(main, 'import_executor', ThreadPoolExecutor(max_workers=1))
+
+    result = main.app.test_cli_runner().invoke(args=['resume-import-jobs'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Marked 1 interrupted import jobs as failed and ran 1 queued jobs' in result.output
+    db.session.expire_all()
+    assert db.session.get(main.ImportJob, interrupted.id).status == 'Failed'
+    assert db.session.get(main.ImportJob, queued.id).status == 'Completed'
+    assert os.listdir(main.IMPORT_JOB_FOLDER) == []
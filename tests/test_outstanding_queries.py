@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+
+import main
+from main import db
+
+
+def _add_billed_students(count):
+    user_ids = db.session.execute(
+        db.insert(main.User).returning(main.User.id, sort_by_parameter_order=True),
+        [{'username': f'student{i}', 'password': 'x', 'email': f'student{i}@example.com', 'role': 'student',
+          'first_name': 'Student', 'last_name': str(i)} for i in range(count)]
+    ).scalars().all()
+    student_ids = db.session.execute(
+        db.insert(main.Student).returning(main.Student.id, sort_by_parameter_order=True),
+        [{'user_id': user_id, 'admission_number': f'ADM{i:05d}', 'class_name': f'Grade {i % 4 + 9}', 'section': 'A'}
+         for i, user_id in enumerate(user_ids)]
+    ).scalars().all()
+    db.session.execute(db.insert(main.Invoice), [
+        {'student_id': student_id, 'invoice_number': f'INV-2026-{i:05d}', 'issue_date': date(2026, 1, 5),
+         'due_date': date(2026, 2, 5), 'total_amount': 100 + i % 50, 'paid_amount': i % 30, 'status': 'Unpaid',
+         'semester': 'Semester 1', 'academic_year': '2026'}
+        for i, student_id in enumerate(student_ids)
+    ])
+    main.rebuild_student_balances()
+    db.session.commit()
+
+
+def _reset_students():
+    db.session.execute(db.delete(main.StudentBalance))
+    db.session.execute(db.delete(main.Invoice))
+    db.session.execute(db.delete(main.Student))
+    db.session.execute(db.delete(main.User).where(main.User.role == 'student'))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'sort': 'balance_asc', 'class_name': 'Grade 10'},
+    {'semester': 'Semester 1', 'academic_year': '2026'}
+])
+def test_outstanding_query_count_does_not_grow_with_students(login_client, rendered, query_counter, params):
+    client = login_client('accounts')
+    counts = {}
+    for students in (10, 100, 1000):
+        _reset_students()
+        _add_billed_students(students)
+
+        with query_counter() as first_page:
+            client.get('/accounts/outstanding', query_string=dict(params, per_page=2))
+        assert len(rendered[-1][1]['outstanding_data']) == 2
+        cursor = rendered[-1][1]['next_cursor']
+        with query_counter() as next_page:
+            client.get('/accounts/outstanding', query_string=dict(params, per_page=2, cursor=cursor))
+        assert rendered[-1][1]['outstanding_data']
+        counts[students] = (first_page.count, next_page.count)
+
+    assert counts[10] == counts[100] == counts[1000]